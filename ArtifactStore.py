@@ -0,0 +1,80 @@
+import gzip
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class _HashingWriter:
+    # Binary file-like for e.g. `Graph.serialize(destination=...)`: compresses what is written and hashes the original.
+
+    def __init__(self, out):
+        self.out = out
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, b):
+        self.sha256.update(b)
+        self.size += len(b)
+        return self.out.write(b)
+
+    def flush(self):
+        self.out.flush()
+
+
+class ArtifactStore:
+    # Exports on local disk as `<sha256 of the content>.gz`, so that workers only need to hand a small handle
+    #  to the web server (which has to share the directory), and identical exports are only stored once.
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, sha256):
+        assert re.fullmatch(r"[0-9a-f]{64}", sha256), sha256  # Don't let anyone wander around the file system.
+        return os.path.join(self.directory, sha256 + ".gz")
+
+    @contextmanager
+    def writer(self):
+        # Yields a binary file to write the export to, and a handle for it (filled in when done).
+        handle = {}
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            # No filename or mtime in the gzip-header, the same content gives the same file:
+            with os.fdopen(fd, "wb") as raw, gzip.GzipFile(filename="", mode="wb", fileobj=raw, mtime=0) as gz:
+                w = _HashingWriter(gz)
+                yield w, handle
+            handle['sha256'] = w.sha256.hexdigest()
+            handle['size'] = w.size
+            handle['gz_size'] = os.path.getsize(tmp)
+            os.replace(tmp, self.path(handle['sha256']))  # Atomic, and a duplicate is as good as the original.
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        logger.info(f"Stored artifact {handle['sha256']}: {handle['size']} bytes, {handle['gz_size']} compressed.")
+
+    def open(self, sha256):
+        # The compressed file, e.g. to stream as-is with `Content-Encoding: gzip`.
+        return open(self.path(sha256), "rb")
+
+    def read(self, sha256):
+        with gzip.open(self.path(sha256), "rt", encoding="utf-8") as f:
+            return f.read()
+
+    def exists(self, sha256):
+        return os.path.exists(self.path(sha256))
+
+    def prune(self, max_age):
+        # Removes artifacts (and leftovers of crashed writers) older than `max_age` seconds.
+        cutoff = time.time() - max_age
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith((".gz", ".tmp")) and entry.stat().st_mtime < cutoff:
+                try:
+                    os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass  # Someone else was faster.
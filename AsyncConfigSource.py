@@ -0,0 +1,143 @@
+import asyncio
+import json
+import logging
+import socket
+import ssl
+import time
+
+import aiohttp
+from aiohttp.abc import AbstractResolver
+
+from ConfigSource import ConfigSource, HAException
+
+logger = logging.getLogger(__name__)
+
+
+class _ForcedIPResolver(AbstractResolver):
+    # Equivalent of the ForcedIPHTTPSAdapter for aiohttp: always connect to `ip`, but keep the hostname for TLS.
+    def __init__(self, ip):
+        self.ip = ip
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        return [{'hostname': host, 'host': self.ip, 'port': port,
+                 'family': family, 'proto': 0, 'flags': socket.AI_NUMERICHOST}]
+
+    async def close(self):
+        pass
+
+
+class HAWebSocket:
+    # Multiplexes many commands on one authenticated websocket, matching responses to requests by `id`.
+    def __init__(self, ws, stats=None):
+        self.ws = ws
+        self.stats = stats
+        self.ws_counter = 1
+        self.pending = {}
+        self.reader = asyncio.create_task(self._read())
+
+    async def _read(self):
+        try:
+            async for msg in self.ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                data = json.loads(msg.data)
+                # HA may coalesce several messages into one frame:
+                for m in data if isinstance(data, list) else [data]:
+                    fut = self.pending.pop(m.get('id'), None)
+                    if fut is None:
+                        # Unsolicited, e.g. events. Not for us.
+                        logger.debug(f"Ignoring websocket message {m}")
+                    elif not fut.done():
+                        size = len(json.dumps(m)) if isinstance(data, list) else len(msg.data)
+                        fut.set_result((m, size))
+        finally:
+            for fut in self.pending.values():
+                if not fut.done():
+                    fut.set_exception(HAException("Websocket closed with requests in flight."))
+            self.pending.clear()
+
+    async def command(self, command, **kwargs):
+        q = {'type': command, 'id': self.ws_counter, **kwargs}
+        self.ws_counter += 1
+        fut = asyncio.get_running_loop().create_future()
+        self.pending[q['id']] = fut
+        t = time.perf_counter()
+        await self.ws.send_str(json.dumps(q))
+        q_result, size = await fut
+        if self.stats is not None:
+            self.stats.request("ws:" + command, time.perf_counter() - t, size)
+        assert q_result['success'], q_result
+        return q_result['result']
+
+    async def close(self):
+        await self.ws.close()
+        await self.reader
+
+
+class AsyncConfigSource(ConfigSource):
+    # Fetches everything that `HACVT.main` needs with all queries in flight at the same time.
+    # After `prefetch()`, the usual synchronous getters are served from memory, so the export
+    #  costs about one round trip for the registries/states/services, and one for the automation configs.
+    @classmethod
+    def fromSource(cls, cs):
+        # Inherit connection settings, e.g. from a CLISource.
+        acs = cls(cs.hass_url, cs.token)
+        acs.mount_ip = cs.mount_ip
+        acs.session.verify = cs.session.verify
+        return acs
+
+    def connect(self, certificate=None):
+        # We're not using the blocking websocket at all, but templates still go through the session.
+        self._mountSession()
+
+    def _ssl(self):
+        if self.session.verify is None:
+            return False
+        if isinstance(self.session.verify, str):
+            return ssl.create_default_context(cafile=self.session.verify)
+        return True  # default validation
+
+    async def _ws_connect_async(self, session):
+        ws_url = "ws" + self.hass_url[4:] + "websocket"
+        logger.info(f'Connecting to {ws_url}...')
+        # Registries and states of large installations easily exceed aiohttp's default message limit.
+        ws = await session.ws_connect(ws_url, ssl=self._ssl(), max_msg_size=0)
+        welcome_msg = await ws.receive_str()  # Consume hello-msg
+        assert welcome_msg.startswith('{"type":"auth_required"'), welcome_msg
+        await ws.send_str(json.dumps({'type': "auth", 'access_token': self.token}))
+        auth_result = json.loads(await ws.receive_str())
+        assert auth_result['type'] == "auth_ok", auth_result
+        return HAWebSocket(ws, self.stats)
+
+    async def prefetch(self, needed=lambda state: True):
+        resolver = _ForcedIPResolver(self.mount_ip) if self.mount_ip is not None else None
+        connector = aiohttp.TCPConnector(resolver=resolver)
+        headers = {'User-Agent': 'HOWL-exporter/0.1 vs+howl@foldr.org'}
+        async with aiohttp.ClientSession(connector=connector, headers=headers) as session:
+            client = await self._ws_connect_async(session)
+            try:
+                registries = ["config/device_registry/list", "config/entity_registry/list",
+                              "config/area_registry/list"]
+                *results, states, services = await asyncio.gather(
+                    *[client.command(c) for c in registries],
+                    client.command("get_states"),
+                    client.command("get_services"))
+                for c, r in zip(registries, results):
+                    self.prefetched["ws:" + c] = r
+                # Same shape as the REST-API:
+                self.prefetched["states"] = states
+                self.prefetched["services"] = [{'domain': d, 'services': s} for d, s in services.items()]
+
+                # Second round trip: we only learn the automation ids from the states.
+                automations = self.getAutomationStates(states)
+                todo = [a_id for a_id in self._unfetchedAutomations(automations) if needed(automations[a_id])]
+                configs = await asyncio.gather(*[client.command("automation/config",
+                                                                entity_id=automations[a_id]['entity_id'])
+                                                 for a_id in todo])
+                for a_id, r in zip(todo, configs):
+                    self.prefetched["automation_config:" + a_id] = r['config']
+                if todo:
+                    self._saveAutomationCache(automations)
+            finally:
+                await client.close()
+        logger.info(f"Prefetched {len(self.prefetched)} responses.")
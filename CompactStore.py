@@ -0,0 +1,217 @@
+from array import array
+from bisect import bisect_left, insort
+from heapq import merge
+
+from rdflib.store import Store
+
+from NTriplesWriter import ntTerm
+
+# Terms are interned to ids, and a triple is packed into a single 64-bit key per index ordering.
+BITS = 21
+MASK = (1 << BITS) - 1
+MAX_TERMS = 1 << BITS
+FLUSH = 1 << 16  # Inserts or removals buffered before they are merged into the indexes.
+
+
+def _pack(a, b, c):
+    return (a << (2 * BITS)) | (b << BITS) | c
+
+
+def _unpack(k):
+    return k >> (2 * BITS), (k >> BITS) & MASK, k & MASK
+
+
+class _Index:
+    # Sorted packed keys in one ordering (e.g. s-p-o), plus a small sorted buffer of recent inserts and a set of
+    #  removed keys ("tombstones"). Both are only merged into the keys by `flush`, which is O(n).
+    def __init__(self):
+        self.keys = array('Q')
+        self.pending = []
+        self.removed = set()
+
+    def flush(self):
+        if self.pending or self.removed:
+            removed = self.removed
+            self.keys = array('Q', (k for k in merge(self.keys, self.pending) if k not in removed))
+            self.pending = []
+            self.removed = set()
+
+    def add(self, k):
+        insort(self.pending, k)
+
+    @staticmethod
+    def _range(keys, lo, hi):
+        i = bisect_left(keys, lo)
+        while i < len(keys) and keys[i] < hi:
+            yield keys[i]
+            i += 1
+
+    def range(self, lo, hi):
+        removed = self.removed
+        for k in merge(self._range(self.keys, lo, hi), self._range(self.pending, lo, hi)):
+            if k not in removed:
+                yield k
+
+    def remove(self, k):
+        self.removed.add(k)
+
+
+class CompactStore(Store):
+    # Dictionary-encoded, array-backed triple store for large exports: ~3 machine words per triple
+    #  instead of rdflib's nested dicts of term objects. Not context-aware, like SimpleMemory.
+
+    def __init__(self, configuration=None, identifier=None):
+        super().__init__(configuration)
+        self.identifier = identifier
+        self.ids = {}
+        self.terms = []
+        self.nt = []  # N-Triples representation per term id, computed on demand.
+        self.seen = set()  # Keys of triples not yet merged into `spo`, for dedup.
+        self.spo = _Index()
+        self.pos = _Index()
+        self.osp = _Index()
+        self.__namespace = {}
+        self.__prefix = {}
+
+    def _intern(self, term):
+        i = self.ids.get(term)
+        if i is None:
+            i = len(self.terms)
+            assert i < MAX_TERMS, "Too many distinct terms for CompactStore."
+            self.ids[term] = i
+            self.terms.append(term)
+            self.nt.append(None)
+        return i
+
+    def _contains(self, k):
+        if k in self.spo.removed:
+            return False
+        if k in self.seen:
+            return True
+        keys = self.spo.keys
+        i = bisect_left(keys, k)
+        return i < len(keys) and keys[i] == k
+
+    def add(self, triple, context, quoted=False):
+        s, p, o = (self._intern(t) for t in triple)
+        k = _pack(s, p, o)
+        if k in self.spo.removed:
+            # Still there until the next flush, we only have to forget that it was removed:
+            self.spo.removed.discard(k)
+            self.pos.removed.discard(_pack(p, o, s))
+            self.osp.removed.discard(_pack(o, s, p))
+            return
+        if self._contains(k):
+            return
+        self.seen.add(k)
+        self.spo.add(k)
+        self.pos.add(_pack(p, o, s))
+        self.osp.add(_pack(o, s, p))
+        self._maybeFlush(len(self.seen))
+
+    def _maybeFlush(self, n):
+        # Keep the buffers small, as inserting is O(len(pending)), but merge rarely, as that is O(n):
+        if n > FLUSH:
+            self._flush()
+
+    def _flush(self):
+        self.seen.clear()
+        self.spo.flush()
+        self.pos.flush()
+        self.osp.flush()
+
+    def _match(self, pattern):
+        # Yields (s, p, o)-ids matching the pattern, using the index with the longest bound prefix.
+        ids = []
+        for t in pattern:
+            if t is None:
+                ids.append(None)
+            elif t in self.ids:
+                ids.append(self.ids[t])
+            else:
+                return  # Unknown term, can't match.
+        s, p, o = ids
+        if s is not None:
+            if p is not None:
+                lo = _pack(s, p, 0 if o is None else o)
+                hi = lo + (1 if o is not None else 1 << BITS)
+            else:
+                lo = _pack(s, 0, 0)
+                hi = lo + (1 << 2 * BITS)
+            for k in self.spo.range(lo, hi):
+                ks, kp, ko = _unpack(k)
+                if o is None or ko == o:
+                    yield ks, kp, ko
+        elif p is not None:
+            lo = _pack(p, 0 if o is None else o, 0)
+            hi = lo + (1 << BITS if o is not None else 1 << 2 * BITS)
+            for k in self.pos.range(lo, hi):
+                kp, ko, ks = _unpack(k)
+                yield ks, kp, ko
+        elif o is not None:
+            lo = _pack(o, 0, 0)
+            for k in self.osp.range(lo, lo + (1 << 2 * BITS)):
+                ko, ks, kp = _unpack(k)
+                yield ks, kp, ko
+        else:
+            for k in self.spo.range(0, 1 << 3 * BITS):
+                yield _unpack(k)
+
+    def remove(self, triple_pattern, context=None):
+        for s, p, o in list(self._match(triple_pattern)):
+            self.spo.remove(_pack(s, p, o))
+            self.pos.remove(_pack(p, o, s))
+            self.osp.remove(_pack(o, s, p))
+        self._maybeFlush(len(self.spo.removed))
+
+    def triples(self, triple_pattern, context=None):
+        terms = self.terms
+        for s, p, o in self._match(triple_pattern):
+            yield (terms[s], terms[p], terms[o]), iter(())
+
+    def __len__(self, context=None):
+        return len(self.spo.keys) + len(self.spo.pending) - len(self.spo.removed)
+
+    def _nt(self, i):
+        r = self.nt[i]
+        if r is None:
+            t = self.terms[i]
+            r = self.nt[i] = ntTerm(t)
+        return r
+
+    def writeNTriples(self, out):
+        # Fast path that skips rdflib's serializer plugins: each term is formatted only once.
+        self._flush()
+        nt = self._nt
+        for k in self.spo.keys:
+            s, p, o = _unpack(k)
+            out.write(f"{nt(s)} {nt(p)} {nt(o)} .\n")
+
+    # Namespace handling, same as rdflib's SimpleMemory:
+    def bind(self, prefix, namespace, override=True):
+        bound_namespace = self.__namespace.get(prefix)
+        bound_prefix = self.__prefix.get(namespace)
+        if bound_prefix is None:
+            bound_prefix = self.__prefix.get(bound_namespace)
+        if override:
+            if bound_prefix is not None:
+                del self.__namespace[bound_prefix]
+            if bound_namespace is not None:
+                del self.__prefix[bound_namespace]
+            self.__prefix[namespace] = prefix
+            self.__namespace[prefix] = namespace
+        else:
+            namespace = bound_namespace if bound_namespace is not None else namespace
+            prefix = bound_prefix if bound_prefix is not None else prefix
+            self.__prefix[namespace] = prefix
+            self.__namespace[prefix] = namespace
+
+    def namespace(self, prefix):
+        return self.__namespace.get(prefix, None)
+
+    def prefix(self, namespace):
+        return self.__prefix.get(namespace, None)
+
+    def namespaces(self):
+        for prefix, namespace in self.__namespace.items():
+            yield prefix, namespace
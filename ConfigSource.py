@@ -1,16 +1,23 @@
 import argparse
 import functools
+import gzip
+import hashlib
 import json
 import logging
 import os
 import socket
 import ssl
 import sys
+import tempfile
+import threading
+import time
 import urllib.parse
 
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from forcediphttpsadapter.adapters import ForcedIPHTTPSAdapter
 from functools import cache
+from requests.adapters import HTTPAdapter
 import requests_cache
 import websocket
 import yaml
@@ -22,20 +29,167 @@ class HAException(Exception):
     pass
 
 
+def writeAtomically(path, data: bytes):
+    # Concurrent workers may race for the same file, but will never see a partial one.
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def queryKind(key):
+    # Groups the keys of `ConfigSource._fetch` into what we want to account for separately.
+    kind, _, arg = key.partition(":")
+    if kind == "template":
+        return "template:" + arg.split("|")[0].strip()
+    if kind == "ws":
+        return key
+    return kind  # states, services, automation_config
+
+
+def cachedQuery(kind):
+    # Like `functools.cache` for the getters below (but per instance), and counts what it serves from memory
+    #  as hits of that `kind` of query.
+    def decorator(method):
+        name = "_cached_" + method.__name__
+
+        @functools.wraps(method)
+        def wrapper(self, *args):
+            memo = self.__dict__.setdefault(name, {})
+            try:
+                r = memo[args]
+            except KeyError:
+                r = memo[args] = method(self, *args)
+                return r
+            self.stats.hit(kind)
+            return r
+        return wrapper
+    return decorator
+
+
+class QueryStats:
+    # Per kind of query: requests that went to Home Assistant, responses we could serve without it ("hits": cached,
+    #  prefetched or replayed), bytes received and a histogram of request latencies.
+    BUCKETS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10]  # Upper bounds in seconds.
+
+    def __init__(self):
+        self.kinds = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def _kind(self, kind):
+        k = self.kinds.get(kind)
+        if k is None:
+            k = self.kinds[kind] = {'calls': 0, 'hits': 0, 'bytes': 0, 'seconds': 0.0,
+                                    'histogram': [0] * (len(self.BUCKETS) + 1)}
+        return k
+
+    def received(self, n):
+        # Called by the low-level fetchers, for whatever request is in progress on this thread.
+        self.local.received = getattr(self.local, 'received', 0) + n
+
+    def request(self, kind, seconds, n):
+        with self.lock:
+            k = self._kind(kind)
+            k['calls'] += 1
+            k['bytes'] += n
+            k['seconds'] += seconds
+            i = 0
+            while i < len(self.BUCKETS) and seconds > self.BUCKETS[i]:
+                i += 1
+            k['histogram'][i] += 1
+
+    def hit(self, kind):
+        with self.lock:
+            self._kind(kind)['hits'] += 1
+
+    def measure(self, kind, fetcher):
+        self.local.received = 0
+        t = time.perf_counter()
+        result = fetcher()
+        self.request(kind, time.perf_counter() - t, self.local.received)
+        return result
+
+    def toJSON(self):
+        return {'buckets': self.BUCKETS, 'kinds': self.kinds}
+
+    def summary(self):
+        lines = [f"{'query':<40} {'calls':>6} {'hits':>6} {'KiB':>9} {'total/s':>8} {'mean/ms':>8}  latency histogram"]
+        for kind, k in sorted(self.kinds.items(), key=lambda kv: -kv[1]['seconds']):
+            mean = 1000 * k['seconds'] / k['calls'] if k['calls'] else 0
+            lines.append(f"{kind[:40]:<40} {k['calls']:>6} {k['hits']:>6} {k['bytes'] / 1024:>9.1f} "
+                         f"{k['seconds']:>8.2f} {mean:>8.1f}  {' '.join(str(c) for c in k['histogram'])}")
+        lines.append(f"Latency buckets (upper bounds, s): {' '.join(str(b) for b in self.BUCKETS)} inf")
+        return "\n".join(lines)
+
+
 class ConfigSource:
-    # session = requests_cache.CachedSession('my_cache')
-    session = requests.Session()
+    POOL_SIZE = 8  # Concurrent requests to Home Assistant, see `prefetchAutomationConfigs`.
     mount_ip = None  # XXX Doesn't really belong in here now that we have Flask.
+    recording = None  # Responses by key while recording a snapshot, see `SnapshotSource`.
+    automation_cache = None  # File with automation configs of earlier runs, see `useAutomationCache`.
 
     def __init__(self, url, token):
         self.hass_url = url
         self.token = token
+        self.stats = QueryStats()
+        self.prefetched = {}  # Responses by key that we already have, e.g. fetched in bulk or concurrently.
+        # Our own, since it carries our token (and mount, see `connect`):
+        # self.session = requests_cache.CachedSession('my_cache')
+        self.session = requests.Session()
         self.session.headers = {'Content-type': 'application/json',
                                 'Authorization': 'Bearer ' + token,
                                 'User-Agent': 'HOWL-exporter/0.1 vs+howl@foldr.org'
                                 }
 
-    def getYAML(self, query):
+    def connect(self, certificate=None):
+        self._mountSession()
+        self.ws = self._ws_connect(certificate=certificate)
+        self.ws_counter = 1
+
+    def _mountSession(self):
+        # Keep up to POOL_SIZE connections around for concurrent requests.
+        pool = {'pool_connections': 1, 'pool_maxsize': self.POOL_SIZE}
+        if self.mount_ip is not None:
+            self.session.mount(self.hass_url, ForcedIPHTTPSAdapter(dest_ip=self.mount_ip, **pool))
+        else:
+            self.session.mount(self.hass_url, HTTPAdapter(**pool))
+
+    def _fetch(self, key, fetcher):
+        # Every query to Home Assistant goes through here, `key` identifies its (raw) response.
+        kind = queryKind(key)
+        fetched = False
+
+        def measured():
+            nonlocal fetched
+            fetched = True
+            return self.stats.measure(kind, fetcher)
+        result = self._query(key, measured)
+        if not fetched:
+            self.stats.hit(kind)
+        if self.recording is not None:
+            self.recording[key] = result
+        return result
+
+    def _query(self, key, fetcher):
+        # Subclasses can serve responses from elsewhere, e.g. recorded ones.
+        if key in self.prefetched:
+            return self.prefetched[key]
+        return fetcher()
+
+    def startRecording(self):
+        self.recording = {}
+
+    def saveSnapshot(self, path):
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump({'version': SnapshotSource.VERSION, 'url': self.hass_url, 'responses': self.recording}, f)
+        logger.info(f"Recorded {len(self.recording)} responses to {path}.")
+
+    def _template(self, query) -> str:
         http_data = {'template': '{{ ' + query + ' }}'}
         j_response = self.session.post(self.hass_url + "template", json=http_data)
         if j_response.status_code == 401:
@@ -44,26 +198,39 @@ class ConfigSource:
             raise HAException("Your token does not seem to have admin privileges that the tool needs to execute some " \
                           "queries via templates.\n Please obtain an admin-token and try again.")
         assert j_response.status_code == 200, f"YAML request failed: " + str(j_response.text)
-        return yaml.safe_load(j_response.text)
+        self.stats.received(len(j_response.content))
+        return j_response.text
+
+    def getYAML(self, query):
+        return yaml.safe_load(self.getYAMLText(query))
 
     def getYAMLText(self, query) -> str:
-        http_data = {'template': '{{ ' + query + ' }}'}
-        j_response = self.session.post(self.hass_url + "template", json=http_data)
-        assert j_response.status_code == 200, f"YAML request failed: " + str(j_response.text)
-        return j_response.text
+        return self._fetch("template:" + query, lambda: self._template(query))
+
+    def _ws_command(self, command):
+        def fetcher():
+            q = {'type': command, 'id': self.ws_counter}
+            self.ws_counter += 1
+            self.ws.send(json.dumps(q))
+            data = self.ws.recv()
+            self.stats.received(len(data))
+            q_result = json.loads(data)
+            assert q_result['success'], q_result
+            return q_result['result']
+        return self._fetch("ws:" + command, fetcher)
+
+    @cachedQuery("ws:config/device_registry/list")
+    def getDeviceRegistry(self):
+        # One bulk query instead of one template-POST per device and attribute.
+        index = {}
+        for r in self._ws_command("config/device_registry/list"):
+            logger.debug(r)
+            index[r['id']] = r
+        return index
 
     @cache
     def getDevices(self):
-        q = {'type': "config/device_registry/list", 'id': self.ws_counter}
-        self.ws_counter += 1
-        self.ws.send(json.dumps(q))
-        q_result = json.loads(self.ws.recv())
-        assert q_result['success'], q_result
-        r_list = q_result['result']
-        q_list = []
-        for r in r_list:
-            print(r)
-            q_list.append(r['id'])
+        q_list = list(self.getDeviceRegistry())
 
         # TODO: remove after enough testing
         t = self.getYAML('states | map(attribute="entity_id")|map("device_id") | unique | reject("eq",None) | list')
@@ -118,59 +285,193 @@ class ConfigSource:
         assert auth_result['type'] == "auth_ok", auth_result
         return ws
 
-    def getDeviceEntities(self, device):
-        return self.getYAML('device_entities("' + device + '")')
+    @cachedQuery("ws:config/entity_registry/list")
+    def getEntityRegistry(self):
+        return {r['entity_id']: r for r in self._ws_command("config/entity_registry/list")}
 
     @cache
+    def getDeviceEntityIndex(self):
+        # Inverse of the entity registry, so that we don't have to ask per device:
+        device_entities = {}
+        for e, r in self.getEntityRegistry().items():
+            # Same as the `device_entities()`-template, which skips disabled entities:
+            if r['device_id'] is not None and r.get('disabled_by') is None:
+                device_entities.setdefault(r['device_id'], []).append(e)
+        return device_entities
+
+    def getDeviceEntities(self, device):
+        return self.getDeviceEntityIndex().get(device, [])
+
+    @cachedQuery("ws:config/area_registry/list")
+    def getAreas(self):
+        return {r['area_id']: r['name'] for r in self._ws_command("config/area_registry/list")}
+
+    def getAreaName(self, area_id) -> str:
+        return str(self.getAreas().get(area_id))
+
+    def getEntityAreaId(self, entity) -> str:
+        # Entities can override the area of their device; "None" if they don't.
+        entry = self.getEntityRegistry().get(entity)
+        return str(entry.get('area_id') if entry is not None else None)
+
+    # Attribute names in templates that are named differently in the registry:
+    DEVICE_ATTR_ALIASES = {'via_device': 'via_device_id'}
+
     def getDeviceAttr(self, device, attr) -> str:
-        return self.getYAMLText('device_attr("' + device + '","' + attr + '")')
+        # Mimics `device_attr()` rendered through a template, ie. missing values come back as "None".
+        entry = self.getDeviceRegistry().get(device)
+        if entry is None:
+            return "None"
+        return str(entry.get(self.DEVICE_ATTR_ALIASES.get(attr, attr)))
 
-    @cache
     def getDeviceId(self, entity):
-        return self.getYAML(f'device_id("{entity}")')
+        # Careful, string -- like the template would have rendered it.
+        entry = self.getEntityRegistry().get(entity)
+        return str(entry['device_id'] if entry is not None else None)
 
     @cache
+    def getStatesIndex(self):
+        # Built once from the single /api/states response instead of one GET per entity.
+        return {s['entity_id']: s.get('attributes', {}) for s in self.getStates()}
+
     def getAttributes(self, e):
-        # TODO: could bounce through cached getStates() now.
-        result = self.session.get(f"{self.hass_url}states/{e}")
-        j = json.loads(result.text)
-        return j['attributes'] if 'attributes' in j else {}
+        return self.getStatesIndex().get(e, {})
 
-    @cache
-    def getStates(self):
-        result = self.session.get(f"{self.hass_url}states")
+    def _get(self, path):
+        result = self.session.get(f"{self.hass_url}{path}")
+        assert result.status_code == 200, (result.status_code, result.text)
+        self.stats.received(len(result.content))
         return result.json()
 
-    @cache
+    @cachedQuery("states")
+    def getStates(self):
+        return self._fetch("states", lambda: self._get("states"))
+
+    @cachedQuery("services")
     def getServices(self):
-        result = self.session.get(f"{self.hass_url}services")
-        assert result.status_code == 200, (result.status_code, result.text)
         out = {}
-        for k in result.json():
+        for k in self._fetch("services", lambda: self._get("services")):
             out[k['domain']] = k['services']
         return out
 
-    @cache
+    def getAutomationStates(self, states=None):
+        # Automation id -> state, for those automations that have an id (ie. that we can fetch the config of).
+        return {s['attributes']['id']: s for s in (self.getStates() if states is None else states)
+                if s['entity_id'].startswith("automation.") and 'id' in s['attributes']}
+
+    def useAutomationCache(self, directory):
+        # Keep automation configs between runs, one file per Home Assistant.
+        name = hashlib.sha256(self.hass_url.encode()).hexdigest()[:16]
+        self.automation_cache = os.path.join(directory, f"automations-{name}.json.gz")
+
+    @staticmethod
+    def _automationVersion(state):
+        # HA re-creates the state when an automation is (re)loaded, e.g. after editing it.
+        return state.get('last_changed', state.get('last_updated'))
+
+    def _unfetchedAutomations(self, automations):
+        # Serves the configs of unchanged automations from the cache, and returns the ids of those we still need.
+        cached = {}
+        if self.automation_cache is not None:
+            try:
+                with gzip.open(self.automation_cache, "rt", encoding="utf-8") as f:
+                    cached = json.load(f)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError):
+                logger.warning(f"Ignoring corrupt automation cache {self.automation_cache}.")
+        todo = []
+        for a_id, state in automations.items():
+            key = "automation_config:" + a_id
+            c = cached.get(a_id)
+            if key in self.prefetched:
+                continue
+            if c is not None and c['version'] == self._automationVersion(state):
+                self.prefetched[key] = c['config']
+            else:
+                todo.append(a_id)
+        logger.info(f"{len(automations) - len(todo)} automation configs cached, fetching {len(todo)}.")
+        return todo
+
+    def _saveAutomationCache(self, automations):
+        if self.automation_cache is None:
+            return
+        out = {a_id: {'version': self._automationVersion(state), 'config': self.prefetched[key]}
+               for a_id, state in automations.items() if (key := "automation_config:" + a_id) in self.prefetched}
+        writeAtomically(self.automation_cache, gzip.compress(json.dumps(out).encode(), mtime=0))
+
+    def prefetchAutomationConfigs(self, needed=lambda state: True, workers=POOL_SIZE):
+        # One blocking GET per automation adds up, so fetch them all concurrently, with at most `workers` in flight.
+        # Only those that are `needed`, e.g. not those that we can reuse from a previous export.
+        automations = self.getAutomationStates()
+        todo = [a_id for a_id in self._unfetchedAutomations(automations) if needed(automations[a_id])]
+        if len(todo) == 0:
+            return
+
+        def fetch(a_id):
+            return self.stats.measure("automation_config", lambda: self._get(f"config/automation/config/{a_id}"))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for a_id, config in zip(todo, executor.map(fetch, todo)):
+                self.prefetched["automation_config:" + a_id] = config
+        self._saveAutomationCache(automations)
+
+    @cachedQuery("automation_config")
     def getAutomationConfig(self, automation_id):
-        result = self.session.get(f"{self.hass_url}config/automation/config/{automation_id}")
-        assert result.status_code == 200, (result.status_code, result.text)
-        return result.json()
+        return self._fetch("automation_config:" + automation_id,
+                           lambda: self._get(f"config/automation/config/{automation_id}"))
+
+
+class SnapshotSource(ConfigSource):
+    # Replays a snapshot recorded with `startRecording()`/`saveSnapshot()` without any network access.
+    VERSION = 1
+
+    def __init__(self, path):
+        # Deliberately not calling super(): we neither have nor need a token.
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            snapshot = json.load(f)
+        if snapshot.get('version') != self.VERSION:
+            raise HAException(f"Unsupported snapshot version {snapshot.get('version')} in {path}.")
+        self.hass_url = snapshot['url']
+        self.token = None
+        self.stats = QueryStats()
+        self.responses = snapshot['responses']
+
+    def connect(self, certificate=None):
+        pass
+
+    def prefetchAutomationConfigs(self, needed=lambda state: True, workers=ConfigSource.POOL_SIZE):
+        pass  # We have them all.
+
+    def _query(self, key, fetcher):
+        try:
+            return self.responses[key]
+        except KeyError:
+            raise HAException(f"The snapshot does not contain a response for `{key}`.")
 
 
 class CLISource(ConfigSource):
 
     def __init__(self, parser: argparse.ArgumentParser):
-        parser.add_argument('url',
+        parser.add_argument('url', nargs='?',
                             help='Full path to API, e.g. https://homeassistant.local:8123/api/.')
-        parser.add_argument('token', metavar='TOKENVAR',
+        parser.add_argument('token', metavar='TOKENVAR', nargs='?',
                             help='Name of environment variable where you keep your long-lived access token. NOT THE LITERAL TOKEN!')
         parser.add_argument('-m', '--mount', metavar='192.0.2.1',
                             help='Use ForcedIPHTTPSAdapter to override IP for URL; useful on internal IPs.')
         parser.add_argument('-c', '--certificate', metavar='ca.crt',
                             help='Path to a CA certificate to validate your https-connection if needed. The string'
                                  ' "None" will disable validation.')
+        parser.add_argument('--record', metavar='snapshot.json.gz',
+                            help='Record all responses from Home Assistant into a snapshot file.')
+        parser.add_argument('--replay', metavar='snapshot.json.gz',
+                            help='Replay a recorded snapshot instead of connecting to Home Assistant; '
+                                 'no URL or token needed.')
         args = parser.parse_args()  # TODO: could be more modular in the future
         self.args = args  # We may need the results outside. XXX Not any more?
+        if args.replay is not None:
+            return  # Caller uses a SnapshotSource instead, we're only carrying the arguments.
+        if args.url is None or args.token is None:
+            parser.error("url and TOKENVAR are required unless you --replay a snapshot.")
         token = os.getenv(args.token)
         if token is None:
             print(f"Aborting: the environment variable for the token that you specified on the command line does not"
@@ -179,8 +480,7 @@ class CLISource(ConfigSource):
         super().__init__(args.url, token)
         # Set on-demand.
         if args.mount is not None:
-            self.session.mount(args.url, ForcedIPHTTPSAdapter(dest_ip=args.mount))
-            self.mount_ip = args.mount
+            self.mount_ip = args.mount  # Mounted in `connect`.
         else:
             self.mount_ip = None
         if args.certificate is not None:
@@ -0,0 +1,64 @@
+import gzip
+import logging
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class ExportDB:
+    # Submitted exports in SQLite, gzipped (as in the `ArtifactStore`), so that they can be streamed out as they are.
+    # Call `setup` once at startup; each thread then reuses its own connection.
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL, and only fsyncs at checkpoints.
+        return conn
+
+    def setup(self):
+        conn = self.connection()
+        conn.execute("PRAGMA journal_mode=WAL")  # Persistent: readers no longer block the writer and vice versa.
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")  # Several processes may be starting up at once.
+            conn.execute("CREATE TABLE IF NOT EXISTS exports (id INTEGER PRIMARY KEY, "
+                         "datetime TEXT NOT NULL DEFAULT (datetime('now')), url TEXT NOT NULL, privacy TEXT, "
+                         "data BLOB NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS exports_url ON exports (url)")
+            conn.execute("CREATE INDEX IF NOT EXISTS exports_datetime ON exports (datetime)")
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='data'").fetchone():
+                self._migrate(conn)
+
+    @staticmethod
+    def _migrate(conn):
+        # The old table had neither a key nor compression, and `/query/<id>` counted rows from 0 in storage order,
+        #  so that's the id they keep. Compressed row by row inside SQLite, the table may be large.
+        conn.create_function("gzip", 1, lambda data: gzip.compress((data or "").encode(), mtime=0),
+                             deterministic=True)
+        n = conn.execute("INSERT INTO exports (id, datetime, url, privacy, data) "
+                         "SELECT row_number() OVER (ORDER BY rowid) - 1, datetime, url, privacy, gzip(data) "
+                         "FROM data ORDER BY rowid").rowcount
+        conn.execute("DROP TABLE data")
+        logger.info(f"Migrated {n} exports to the new table.")
+
+    def add(self, url, privacy, gz, size, chunk=1 << 16):
+        # `gz` is a binary file with `size` bytes of gzipped Turtle, which we copy over in chunks.
+        with self.connection() as conn:
+            id = conn.execute("INSERT INTO exports (url, privacy, data) VALUES (?, ?, zeroblob(?))",
+                              (url, privacy, size)).lastrowid
+            with conn.blobopen("exports", "data", id) as blob:
+                while data := gz.read(chunk):
+                    blob.write(data)
+        return id
+
+    def open(self, id):
+        # The gzipped export as a file-like `sqlite3.Blob` (close it when done), None if there is no such export.
+        try:
+            return self.connection().blobopen("exports", "data", id, readonly=True)
+        except sqlite3.OperationalError:  # "no such rowid"
+            return None
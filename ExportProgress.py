@@ -0,0 +1,34 @@
+import time
+
+
+class ExportProgress:
+    # How far an export is: the current phase, and devices and automations done out of their totals.
+    # Reported to `callback` (e.g. to update a Celery task) at most every `interval` seconds,
+    #  except for new phases and totals, which are always reported right away.
+
+    def __init__(self, callback=None, interval=0.5):
+        self.callback = callback
+        self.interval = interval
+        self.state = {'phase': None, 'devices_done': 0, 'devices_total': None,
+                      'automations_done': 0, 'automations_total': None}
+        self.last = 0.0
+
+    def phase(self, name):
+        self.state['phase'] = name
+        self._report(force=True)
+
+    def total(self, kind, n):
+        self.state[kind + '_total'] = n
+        self._report(force=True)
+
+    def done(self, kind, n=1):
+        self.state[kind + '_done'] += n
+        self._report()
+
+    def _report(self, force=False):
+        if self.callback is None:
+            return
+        now = time.monotonic()
+        if force or now - self.last >= self.interval:
+            self.last = now
+            self.callback(dict(self.state))
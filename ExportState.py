@@ -0,0 +1,104 @@
+import gzip
+import hashlib
+import json
+import logging
+
+from rdflib import Graph
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ExportState:
+    # An export is a header plus self-contained units (a device with its entities, an orphan entity,
+    #  an automation). For each unit we remember the triples it contributed and a fingerprint of the
+    #  source data it was built from, so that the next run only rebuilds the units that changed.
+    VERSION = 1
+    HEADER = ""
+
+    def __init__(self, settings, previous=None, track=True):
+        self.settings = settings  # Fingerprint of everything that affects ALL units.
+        self.track = track or previous is not None
+        self.fingerprints = {}
+        self.triples = {}  # unit -> N-Triples
+        if previous is not None and previous.settings != settings:
+            logger.warning("Settings or Home Assistant services changed since the previous export, rebuilding all.")
+            previous = None
+        self.previous = previous
+        self.reused = 0
+        self.rebuilt = 0
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            j = json.load(f)
+        assert j['version'] == cls.VERSION, f"Unsupported export state version {j['version']} in {path}."
+        state = cls(j['settings'])
+        state.fingerprints = j['fingerprints']
+        state.triples = j['triples']
+        return state
+
+    def save(self, path):
+        assert self.track
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump({'version': self.VERSION, 'settings': self.settings,
+                       'fingerprints': self.fingerprints, 'triples': self.triples}, f)
+
+    def header(self, g):
+        # Whatever is in the output graph before the first unit.
+        if self.track:
+            self.triples[self.HEADER] = g.serialize(format='nt')
+
+    def isReusable(self, key, fp):
+        return self.previous is not None and self.previous.fingerprints.get(key) == fp
+
+    def unit(self, g, key, fp_fn, build):
+        # `build(u)` populates the graph `u` for this unit -- unless the previous export already has it.
+        #  The fingerprint is only computed (by `fp_fn()`) when we're tracking units.
+        # `g` can also be a streaming writer, then we build each unit on its own and pass on the result.
+        if not self.track and isinstance(g, Graph):
+            build(g)
+            return
+        fp = fp_fn() if self.track else None
+        u = Graph()
+        if self.isReusable(key, fp):
+            nt = self.previous.triples[key]
+            u.parse(data=nt, format='nt')
+            self.reused += 1
+        else:
+            build(u)
+            nt = u.serialize(format='nt') if self.track else None
+            self.rebuilt += 1
+        if self.track:
+            self.fingerprints[key] = fp
+            self.triples[key] = nt
+        # Sorted (as is the header in `HACVT.main`), so that streamed output is byte-identical between runs,
+        #  and between serial and parallel ones.
+        for t in sorted(u):
+            g.add(t)
+
+    def lines(self):
+        out = set()
+        for nt in self.triples.values():
+            out.update(line for line in nt.splitlines() if line.strip())
+        return out
+
+    def writeDelta(self, path, previous):
+        # As SPARQL Update, so that a triple store can apply it as a patch.
+        # N-Triples are valid in DATA-blocks, and each triple is exactly one line.
+        new = self.lines()
+        old = previous.lines()
+        removed = sorted(old - new)
+        added = sorted(new - old)
+        with open(path, "w", encoding="utf-8") as f:
+            print("DELETE DATA {", file=f)
+            for line in removed:
+                print(line, file=f)
+            print("} ;\nINSERT DATA {", file=f)
+            for line in added:
+                print(line, file=f)
+            print("}", file=f)
+        logger.info(f"Delta: {len(added)} added, {len(removed)} removed triples.")
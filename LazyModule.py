@@ -0,0 +1,116 @@
+import enum
+import importlib
+import importlib.metadata
+import importlib.util
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Constants of Home Assistant's modules by module name, see `loadConstants`. When set, we serve attributes from here
+#  and only import the real module for what isn't in there (e.g. schemas).
+SNAPSHOT = None
+
+# Dicts where we only need the keys, but the values can't be serialized:
+KEYS_ONLY = {"ACTION_TYPE_SCHEMAS", "SELECTORS"}
+
+
+class LazyModule:
+    # Stands in for a module that we only import on first use, e.g. `cv = LazyModule("...config_validation")`.
+    # Importing all of homeassistant's modules that we might need takes seconds, and most exports don't need most.
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __repr__(self):
+        return f"LazyModule({self._name})"
+
+    def __getattr__(self, attr):
+        if attr.startswith("__") and attr != "__version__":
+            raise AttributeError(attr)
+        submodule = f"{self._name}.{attr}"
+        if SNAPSHOT is not None and attr in SNAPSHOT.get(self._name, {}):
+            value = SNAPSHOT[self._name][attr]
+        elif SNAPSHOT is not None and submodule in SNAPSHOT:
+            value = LazyModule(submodule)
+        else:
+            if self._module is None:
+                logger.debug(f"Importing {self._name}...")
+                self._module = importlib.import_module(self._name)
+            try:
+                value = getattr(self._module, attr)
+            except AttributeError:
+                # Submodules are only attributes once someone imported them:
+                if importlib.util.find_spec(submodule) is None:
+                    raise
+                value = LazyModule(submodule)
+        setattr(self, attr, value)  # Next time, we won't even get here.
+        return value
+
+
+def _encode(value, keys_only=False):
+    # JSON for what we can rebuild, `None` for what we can't.
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return {'v': value}
+    if isinstance(value, type) and issubclass(value, enum.Enum):
+        for base in (enum.StrEnum, enum.IntFlag, enum.IntEnum):
+            if issubclass(value, base):
+                return {'enum': base.__name__, 'name': value.__name__,
+                        'members': {n: m.value for n, m in value.__members__.items()}}
+        return None
+    if isinstance(value, dict) and all(isinstance(k, str) for k in value):
+        if keys_only:
+            return {'dict': {k: {'v': None} for k in value}}
+        items = {k: _encode(v) for k, v in value.items()}
+        return None if any(v is None for v in items.values()) else {'dict': items}
+    if type(value) in (list, tuple, set, frozenset):  # Not e.g. namedtuples, we couldn't rebuild those.
+        items = [_encode(v) for v in value]
+        if any(v is None for v in items):
+            return None
+        return {type(value).__name__: items}
+    return None
+
+
+def _decode(j):
+    if 'v' in j:
+        return j['v']
+    if 'enum' in j:
+        return getattr(enum, j['enum'])(j['name'], j['members'])
+    if 'dict' in j:
+        return {k: _decode(v) for k, v in j['dict'].items()}
+    for kind, cls in (('list', list), ('tuple', tuple), ('set', set), ('frozenset', frozenset)):
+        if kind in j:
+            return cls(_decode(v) for v in j[kind])
+    raise ValueError(j)
+
+
+def dumpConstants(path, modules):
+    # Snapshot of everything in `modules` that we can rebuild without importing them, see `loadConstants`.
+    snapshot = {}
+    for name in modules:
+        module = importlib.import_module(name)
+        attrs = {}
+        for attr in dir(module):
+            if attr.startswith("__") and attr != "__version__":
+                continue
+            j = _encode(getattr(module, attr), keys_only=attr in KEYS_ONLY)
+            if j is not None:
+                attrs[attr] = j
+        snapshot[name] = attrs
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({'homeassistant': importlib.metadata.version("homeassistant"), 'modules': snapshot}, f)
+    logger.info(f"Wrote constants of {len(snapshot)} modules to {path}.")
+
+
+def loadConstants(path):
+    global SNAPSHOT
+    with open(path, encoding="utf-8") as f:
+        j = json.load(f)
+    try:
+        installed = importlib.metadata.version("homeassistant")
+    except importlib.metadata.PackageNotFoundError:
+        installed = None
+    if installed is not None and installed != j['homeassistant']:
+        logger.warning(f"Constants in {path} are from Home Assistant {j['homeassistant']}, but {installed} is installed.")
+    SNAPSHOT = {name: {attr: _decode(v) for attr, v in attrs.items()} for name, attrs in j['modules'].items()}
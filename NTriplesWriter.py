@@ -0,0 +1,78 @@
+import hashlib
+import socket
+import sys
+from collections import OrderedDict
+
+from rdflib import Literal
+
+
+def ntLiteral(literal):
+    # Like rdflib's N-Triples serializer (not `Literal.n3()`, which e.g. shortens numbers), but without
+    #  depending on its private helpers.
+    encoded = '"%s"' % (str(literal).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+                        .replace("\r", "\\r"))
+    if literal.language:
+        return f"{encoded}@{literal.language}"
+    if literal.datatype:
+        return f"{encoded}^^<{literal.datatype}>"
+    return encoded
+
+
+def ntTerm(term):
+    return ntLiteral(term) if isinstance(term, Literal) else term.n3()
+
+
+def ntRow(triple):
+    return f"{triple[0].n3()} {triple[1].n3()} {ntTerm(triple[2])} .\n"
+
+
+class NTriplesWriter:
+    # Stands in for the output Graph: writes each triple as N-Triples as soon as it's added.
+    # Duplicates are suppressed via short digests of the last `window` distinct triples (roughly 150 bytes each),
+    #  so memory stays bounded by the window. N-Triples are a set anyway, so a duplicate that slips through
+    #  outside the window is harmless.
+    WINDOW = 1 << 16
+
+    def __init__(self, out, window=WINDOW, closer=None):
+        self.out = out
+        self.window = window
+        self.seen = OrderedDict()
+        self.count = 0
+        self.closer = closer
+
+    @classmethod
+    def open(cls, target, **kwargs):
+        # `target` is a filename, `-` for stdout, or `tcp:host:port`.
+        if target == "-":
+            return cls(sys.stdout, **kwargs)
+        if target.startswith("tcp:"):
+            host, port = target[4:].rsplit(":", 1)
+            sock = socket.create_connection((host, int(port)))
+            out = sock.makefile("w", encoding="utf-8")
+
+            def closer():
+                out.close()
+                sock.close()
+            return cls(out, closer=closer, **kwargs)
+        out = open(target, "w", encoding="utf-8")
+        return cls(out, closer=out.close, **kwargs)
+
+    def bind(self, prefix, namespace, *args, **kwargs):
+        pass  # No prefixes in N-Triples.
+
+    def add(self, triple):
+        line = ntRow(triple)
+        key = hashlib.blake2b(line.encode(), digest_size=8).digest()
+        if key in self.seen:
+            self.seen.move_to_end(key)
+            return
+        self.seen[key] = None
+        if len(self.seen) > self.window:
+            self.seen.popitem(last=False)
+        self.out.write(line)
+        self.count += 1
+
+    def close(self):
+        self.out.flush()
+        if self.closer is not None:
+            self.closer()
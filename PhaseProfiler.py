@@ -0,0 +1,48 @@
+import cProfile
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class PhaseProfiler:
+    # Times the phases of an export, and with a `directory` also dumps a pstats-file per phase,
+    #  e.g. for `python -m pstats devices.pstats` or snakeviz.
+    # Units (devices, automations) that take longer than `slow` seconds are logged.
+
+    def __init__(self, directory=None, slow=1.0):
+        self.directory = directory
+        self.slow = slow
+        self.phases = {}  # name -> seconds
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def phase(self, name):
+        profile = cProfile.Profile() if self.directory is not None else None
+        t = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                profile.dump_stats(os.path.join(self.directory, f"{name}.pstats"))
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - t
+            logger.info(f"Phase {name}: {self.phases[name]:.2f}s")
+
+    @contextmanager
+    def unit(self, kind, name):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - t
+            if seconds > self.slow:
+                logger.warning(f"Slow {kind} {name}: {seconds:.2f}s")
+
+    def summary(self):
+        return ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items())
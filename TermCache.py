@@ -0,0 +1,64 @@
+import threading
+from collections import Counter, OrderedDict
+
+from rdflib import URIRef
+from rdflib.namespace import Namespace
+
+_MISSING = object()
+
+
+class TermCache:
+    # Bounded LRU-cache for terms (or anything else) that we'd otherwise rebuild for every triple,
+    #  with hit/miss-counters per kind so that we can see whether it pays off.
+    # Thread-safe, e.g. for `HACVT.buildInParallel` with threads. We don't hold the lock while making a value,
+    #  so two threads may both make it, but they'll end up with equal values.
+    LABEL = "Term cache"
+
+    def __init__(self, maxsize=1 << 16):
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.hits = Counter()
+        self.misses = Counter()
+        self.lock = threading.Lock()
+
+    def get(self, kind, key, make):
+        k = (kind, key)
+        with self.lock:
+            r = self.cache.get(k, _MISSING)
+            if r is not _MISSING:
+                self.cache.move_to_end(k)
+                self.hits[kind] += 1
+                return r
+            self.misses[kind] += 1
+        r = make()
+        with self.lock:
+            self.cache[k] = r
+            if len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+        return r
+
+    def namespace(self, kind, value):
+        return CachedNamespace(value, self, kind)
+
+    def summary(self):
+        stats = []
+        for kind in sorted(self.hits.keys() | self.misses.keys()):
+            h, m = self.hits[kind], self.misses[kind]
+            stats.append(f"{kind} {h}/{h + m} ({100 * h / (h + m):.0f}%)")
+        return f"{self.LABEL} hits: " + ", ".join(stats)
+
+
+class CachedNamespace(Namespace):
+    # A `Namespace` that hands out the same `URIRef` for repeated names.
+
+    def __new__(cls, value, terms, kind):
+        ns = super().__new__(cls, value)
+        ns._terms = terms
+        ns._kind = kind
+        return ns
+
+    def term(self, name):
+        if not isinstance(name, str):
+            return super().term(name)
+        # Several namespaces of one kind may share the cache, e.g. two exports with different `--namespace`:
+        return self._terms.get(self._kind, (str(self), name), lambda: URIRef(self + name))
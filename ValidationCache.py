@@ -0,0 +1,17 @@
+import hashlib
+import json
+
+from TermCache import TermCache
+
+
+class ValidationCache(TermCache):
+    # Validating automation fragments against HA's voluptuous schemas is expensive, and blueprints produce
+    #  the same triggers, conditions and actions over and over again. Config fragments are keyed by a hash of
+    #  their canonical JSON. The validated result is shared between hits, so don't modify it.
+    # Failed validations aren't cached, they raise every time.
+    LABEL = "Validation cache"
+
+    def validate(self, kind, schema, config):
+        canonical = json.dumps(config, sort_keys=True, default=str)
+        key = hashlib.sha256(canonical.encode()).digest()
+        return self.get(kind, key, lambda: schema(config))
@@ -0,0 +1,68 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+import tracemalloc
+
+from AsyncConfigSource import AsyncConfigSource
+from ConfigSource import ConfigSource
+from fakehass import FakeHass, generateInstall
+from hacvt import HACVT, loadSAREF
+
+# End-to-end benchmark of `HACVT.main` against `fakehass` at several scales:
+#  wall time, number of requests to "Home Assistant", and peak (Python-)memory.
+
+
+def exportOnce(url, token, use_async, store):
+    cs = (AsyncConfigSource if use_async else ConfigSource)(url, token)
+    tool = HACVT(cs)
+    if use_async:
+        return asyncio.run(tool.main_async(debug=logging.WARNING, metamodel=False, store=store))
+    return tool.main(debug=logging.WARNING, metamodel=False, store=store)
+
+
+def bench(devices, args):
+    install = generateInstall(devices, args.entities, args.automations or max(1, devices // 10), args.triggers)
+    fake = FakeHass(install)
+    url = fake.start()
+    try:
+        t = time.perf_counter()
+        g = exportOnce(url, fake.token, args.use_async, args.store)
+        wall = time.perf_counter() - t
+        requests = sum(fake.requests.values())
+        triples = len(g)
+        del g
+        # Separate run, since tracing slows everything down:
+        tracemalloc.start()
+        exportOnce(url, fake.token, args.use_async, args.store)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    finally:
+        fake.stop()
+    return {'devices': devices, 'entities': len(install['entities']), 'automations': len(install['automations']),
+            'triples': triples, 'wall': wall, 'requests': requests, 'peak_mb': peak / 1e6}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='bench_export', description="Benchmark exports of synthetic installations.")
+    parser.add_argument('scales', metavar='DEVICES', type=int, nargs='*', default=[10, 100, 1000])
+    parser.add_argument('--entities', type=int, default=4, help="Entities per device.")
+    parser.add_argument('--automations', type=int, default=0, help="Automations, one per 10 devices by default.")
+    parser.add_argument('--triggers', type=int, default=3, help="Triggers per automation.")
+    parser.add_argument('--async', dest='use_async', action='store_true', help="Use the AsyncConfigSource.")
+    parser.add_argument('--store', choices=['default', 'compact'], default='default')
+    parser.add_argument('--json', metavar='results.json', help="Also write the results to a file.")
+    args = parser.parse_args()
+
+    loadSAREF()  # Not part of what we measure.
+    results = []
+    print(f"{'devices':>8} {'entities':>9} {'autom.':>7} {'triples':>9} {'wall/s':>8} {'requests':>9} {'peak/MB':>8}")
+    for n in args.scales:
+        r = bench(n, args)
+        results.append(r)
+        print(f"{r['devices']:>8} {r['entities']:>9} {r['automations']:>7} {r['triples']:>9} {r['wall']:>8.2f} "
+              f"{r['requests']:>9} {r['peak_mb']:>8.1f}", flush=True)
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
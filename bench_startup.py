@@ -0,0 +1,74 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# How long it takes until `hacvt` can start exporting, and what that costs in memory: `import hacvt` and a whole
+#  `--replay`-export, each in a fresh interpreter, with and without a snapshot of HA's constants (HOWL_HA_CONSTANTS).
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+IMPORT = """
+import json, resource, sys, time
+t = time.perf_counter()
+import hacvt
+wall = time.perf_counter() - t
+print(json.dumps({'wall': wall, 'maxrss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  'ha_modules': sum(1 for m in sys.modules if m.startswith('homeassistant'))}))
+"""
+
+REPLAY = """
+import json, resource, runpy, sys, time
+sys.argv = ['hacvt.py', '--replay', sys.argv[1], '-o', sys.argv[2], '--no-metamodel', '-d', 'WARNING']
+t = time.perf_counter()
+try:
+    runpy.run_path(%r, run_name='__main__')
+except SystemExit:
+    pass
+wall = time.perf_counter() - t
+print(json.dumps({'wall': wall, 'maxrss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  'ha_modules': sum(1 for m in sys.modules if m.startswith('homeassistant'))}))
+""" % os.path.join(HERE, "hacvt.py")
+
+
+def runOnce(code, constants, *args):
+    env = dict(os.environ)
+    env.pop('HOWL_HA_CONSTANTS', None)
+    if constants is not None:
+        env['HOWL_HA_CONSTANTS'] = constants
+    env['PYTHONPATH'] = HERE + os.pathsep + env.get('PYTHONPATH', "")
+    p = subprocess.run([sys.executable, "-c", code, *args], env=env, capture_output=True, text=True, check=True)
+    return json.loads(p.stdout.strip().splitlines()[-1])
+
+
+def bench(name, code, constants, repeat, *args):
+    runs = [runOnce(code, constants, *args) for _ in range(repeat)]
+    return {'what': name, 'constants': constants is not None, 'wall': statistics.median(r['wall'] for r in runs),
+            'maxrss_mb': max(r['maxrss_mb'] for r in runs), 'ha_modules': runs[-1]['ha_modules']}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='bench_startup', description="Benchmark the startup of hacvt.")
+    parser.add_argument('--replay', metavar='snapshot.json.gz', help="Also time a whole export of this snapshot.")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per measurement, we report the median.")
+    parser.add_argument('--json', metavar='results.json', help="Also write the results to a file.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        constants = os.path.join(tmp, "constants.json")
+        subprocess.run([sys.executable, os.path.join(HERE, "hacvt.py"), "--dump-constants", constants], check=True)
+        results = []
+        print(f"{'':>8} {'constants':>10} {'wall/s':>8} {'RSS/MB':>8} {'HA modules':>11}")
+        for c in (None, constants):
+            results.append(bench("import", IMPORT, c, args.repeat))
+            if args.replay is not None:
+                results.append(bench("replay", REPLAY, c, args.repeat, args.replay, os.path.join(tmp, "out.ttl")))
+        for r in results:
+            print(f"{r['what']:>8} {str(r['constants']):>10} {r['wall']:>8.2f} {r['maxrss_mb']:>8.1f} "
+                  f"{r['ha_modules']:>11}")
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
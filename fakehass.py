@@ -0,0 +1,249 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+import threading
+from collections import Counter
+
+from aiohttp import web, WSMsgType
+from jinja2.sandbox import ImmutableSandboxedEnvironment
+
+logger = logging.getLogger(__name__)
+
+# Stand-in for the parts of Home Assistant's REST- and websocket-API that `ConfigSource` uses,
+#  serving a synthetic installation. Good enough for benchmarks, not for anything else.
+
+
+def _compact(j):
+    # Like HA's JSON encoder, clients may rely on it.
+    return json.dumps(j, separators=(",", ":"))
+
+
+def generateInstall(devices=10, entities_per_device=2, automations=2, triggers_per_automation=3, seed=0):
+    # A made-up installation of the given size: registries, states, services and automation configs
+    #  in the shape Home Assistant returns them.
+    rnd = random.Random(seed)
+    areas = [{'area_id': f"area_{i}", 'name': f"Area {i}"} for i in range(max(1, devices // 10))]
+    kinds = [("light", {'supported_features': 40}),
+             ("sensor", {'device_class': "temperature", 'unit_of_measurement': "°C"}),
+             ("switch", {}),
+             ("sensor", {'device_class': "humidity", 'unit_of_measurement': "%"})]
+    install = {'devices': [], 'entities': [], 'areas': areas, 'states': [], 'automations': {},
+               'services': [{'domain': "light", 'services': {'turn_on': {}, 'turn_off': {}, 'toggle': {}}},
+                            {'domain': "switch", 'services': {'turn_on': {}, 'turn_off': {}, 'toggle': {}}},
+                            {'domain': "sensor", 'services': {}},
+                            {'domain': "automation", 'services': {'trigger': {}, 'toggle': {}}}]}
+    lights, sensors = [], []
+    for i in range(devices):
+        d = f"device{i:06d}"
+        install['devices'].append({'id': d, 'name': f"Device {i}", 'name_by_user': None,
+                                   'manufacturer': f"Maker {i % 7}", 'model': f"Model {i % 13}",
+                                   'entry_type': None, 'via_device_id': "device000000" if i % 5 == 1 else None,
+                                   'area_id': rnd.choice(areas)['area_id'] if i % 3 else None})
+        for j in range(entities_per_device):
+            domain, attrs = kinds[j % len(kinds)]
+            e = f"{domain}.device_{i}_{j}"
+            (lights if domain == "light" else sensors).append((d, e))
+            install['entities'].append({'entity_id': e, 'device_id': d, 'disabled_by': None,
+                                        'area_id': rnd.choice(areas)['area_id'] if j == 1 else None})
+            install['states'].append({'entity_id': e, 'state': "on",
+                                      'attributes': {**attrs, 'friendly_name': f"Device {i} {j}"},
+                                      'last_changed': "2024-01-01T00:00:00+00:00"})
+    install['states'].append({'entity_id': "sun.sun", 'state': "above_horizon", 'attributes': {'friendly_name': "Sun"},
+                              'last_changed': "2024-01-01T00:00:00+00:00"})
+    for a in range(automations):
+        triggers = []
+        for t in range(triggers_per_automation):
+            if t % 3 == 0 and sensors:
+                triggers.append({'platform': "numeric_state", 'entity_id': rnd.choice(sensors)[1], 'above': 20})
+            elif t % 3 == 1 and lights:
+                d, e = rnd.choice(lights)
+                triggers.append({'platform': "device", 'device_id': d, 'domain': "light", 'entity_id': e,
+                                 'type': "turned_on"})
+            else:
+                triggers.append({'platform': "state", 'entity_id': "sun.sun", 'from': "below_horizon",
+                                 'to': "above_horizon"})
+        actions = [{'delay': "00:00:05"}]
+        if lights:
+            d, e = rnd.choice(lights)
+            actions.insert(0, {'service': "light.turn_on", 'target': {'entity_id': e, 'area_id': areas[0]['area_id']}})
+            actions.append({'device_id': d, 'domain': "light", 'entity_id': e, 'type': "brightness_increase"})
+        install['automations'][str(a)] = {'id': str(a), 'alias': f"Automation {a}", 'trigger': triggers,
+                                          'condition': [], 'action': actions, 'mode': "single"}
+        install['states'].append({'entity_id': f"automation.automation_{a}", 'state': "on",
+                                  'attributes': {'id': str(a), 'friendly_name': f"Automation {a}",
+                                                 'last_triggered': None},
+                                  'last_changed': "2024-01-01T00:00:00+00:00"})
+    return install
+
+
+class FakeHass:
+
+    def __init__(self, install, token="fake-token"):
+        self.install = install
+        self.token = token
+        self.requests = Counter()  # By endpoint or websocket command.
+        self.devices = {d['id']: d for d in install['devices']}
+        self.entities = {e['entity_id']: e for e in install['entities']}
+        self.areas = {a['area_id']: a['name'] for a in install['areas']}
+        self.jinja = ImmutableSandboxedEnvironment()
+        for name in ["device_attr", "device_entities", "device_id", "area_id", "area_name"]:
+            f = getattr(self, "_" + name)
+            self.jinja.globals[name] = f
+            self.jinja.filters[name] = f
+        self.jinja.globals['states'] = install['states']
+
+    # Template functions, see homeassistant.helpers.template:
+    def _device_attr(self, device_id, attr):
+        d = self.devices.get(device_id)
+        return None if d is None else d.get({'via_device': 'via_device_id'}.get(attr, attr))
+
+    def _device_entities(self, device_id):
+        return [e for e, r in self.entities.items() if r['device_id'] == device_id and r['disabled_by'] is None]
+
+    def _device_id(self, entity_id):
+        r = self.entities.get(entity_id)
+        return None if r is None else r['device_id']
+
+    def _area_id(self, lookup):
+        if lookup in self.areas:
+            return lookup
+        r = self.entities.get(lookup)
+        if r is not None:
+            if r['area_id'] is not None:
+                return r['area_id']
+            lookup = r['device_id']
+        d = self.devices.get(lookup)
+        return None if d is None else d['area_id']
+
+    def _area_name(self, lookup):
+        return self.areas.get(lookup if lookup in self.areas else self._area_id(lookup))
+
+    def _authorized(self, request):
+        return request.headers.get('Authorization') == "Bearer " + self.token
+
+    async def template(self, request):
+        self.requests['template'] += 1
+        if not self._authorized(request):
+            return web.Response(status=401)
+        j = await request.json()
+        return web.Response(text=self.jinja.from_string(j['template']).render())
+
+    async def states(self, request):
+        self.requests['states'] += 1
+        if not self._authorized(request):
+            return web.Response(status=401)
+        return web.json_response(self.install['states'])
+
+    async def services(self, request):
+        self.requests['services'] += 1
+        if not self._authorized(request):
+            return web.Response(status=401)
+        return web.json_response(self.install['services'])
+
+    async def automationConfig(self, request):
+        self.requests['automation_config'] += 1
+        if not self._authorized(request):
+            return web.Response(status=401)
+        config = self.install['automations'].get(request.match_info['id'])
+        if config is None:
+            return web.json_response({'message': "Resource not found"}, status=404)
+        return web.json_response(config)
+
+    def _ws_result(self, msg):
+        match msg['type']:
+            case "config/device_registry/list":
+                return self.install['devices']
+            case "config/entity_registry/list":
+                return self.install['entities']
+            case "config/area_registry/list":
+                return self.install['areas']
+            case "get_states":
+                return self.install['states']
+            case "get_services":
+                return {s['domain']: s['services'] for s in self.install['services']}
+            case "automation/config":
+                for s in self.install['states']:
+                    if s['entity_id'] == msg['entity_id']:
+                        return {'config': self.install['automations'][s['attributes']['id']]}
+        raise KeyError(msg['type'])
+
+    async def websocket(self, request):
+        self.requests['websocket'] += 1
+        ws = web.WebSocketResponse(max_msg_size=0)
+        await ws.prepare(request)
+        await ws.send_str(_compact({'type': "auth_required", 'ha_version': "fake"}))
+        auth = await ws.receive_json()
+        if auth.get('access_token') != self.token:
+            await ws.send_str(_compact({'type': "auth_invalid", 'message': "Invalid access token"}))
+            await ws.close()
+            return ws
+        await ws.send_str(_compact({'type': "auth_ok", 'ha_version': "fake"}))
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            q = json.loads(msg.data)
+            self.requests["ws:" + q['type']] += 1
+            try:
+                r = {'id': q['id'], 'type': "result", 'success': True, 'result': self._ws_result(q)}
+            except KeyError:
+                r = {'id': q['id'], 'type': "result", 'success': False,
+                     'error': {'code': "unknown_command", 'message': "Unknown command."}}
+            await ws.send_str(_compact(r))
+        return ws
+
+    def app(self):
+        app = web.Application()
+        app.add_routes([web.post("/api/template", self.template),
+                        web.get("/api/states", self.states),
+                        web.get("/api/services", self.services),
+                        web.get("/api/config/automation/config/{id}", self.automationConfig),
+                        web.get("/api/websocket", self.websocket)])
+        return app
+
+    def start(self, host="127.0.0.1", port=0):
+        # Serves from a background thread, returns the API-URL for a `ConfigSource`.
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        async def serve():
+            self.runner = web.AppRunner(self.app())
+            await self.runner.setup()
+            await web.TCPSite(self.runner, host, port).start()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(serve())
+            ready.set()
+            self.loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        ready.wait()
+        host, port = self.runner.addresses[0][:2]
+        return f"http://{host}:{port}/api/"
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+def addInstallArguments(parser):
+    parser.add_argument('--devices', type=int, default=10)
+    parser.add_argument('--entities', type=int, default=2, help="Entities per device.")
+    parser.add_argument('--automations', type=int, default=2)
+    parser.add_argument('--triggers', type=int, default=3, help="Triggers per automation.")
+    parser.add_argument('--seed', type=int, default=0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='fakehass', description="Serve a synthetic Home Assistant installation.")
+    addInstallArguments(parser)
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8123)
+    parser.add_argument('--token', default="fake-token", help="The literal token that clients have to present.")
+    args = parser.parse_args()
+    install = generateInstall(args.devices, args.entities, args.automations, args.triggers, args.seed)
+    fake = FakeHass(install, args.token)
+    print(f"Serving {args.devices} devices on http://{args.host}:{args.port}/api/", flush=True)
+    web.run_app(fake.app(), host=args.host, port=args.port, print=None)
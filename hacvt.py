@@ -1,52 +1,93 @@
 import argparse
-
-import homeassistant.const as hc
-import homeassistant.core as ha
-from homeassistant.helpers.trigger import _PLATFORM_ALIASES
-import homeassistant.helpers.config_validation as cv
-from homeassistant.components.sensor import SensorDeviceClass
-from homeassistant.components import (
-    automation,
-    binary_sensor,
-    button,
-    climate,
-    device_automation,
-    fan,
-    light,
-    mqtt,
-    remote,
-    sensor,
-    sun,
-    switch,
-    zone,
-)
-import homeassistant.components.button.device_action
-import homeassistant.components.climate.device_action
-import homeassistant.components.fan.device_action
-import homeassistant.components.light.device_action
-import homeassistant.components.mqtt.device_trigger
-import homeassistant.components.switch.device_action
-import homeassistant.components.zone.trigger
-
-# Import some constants for later use: obviously this ain't gonna scale!
-from homeassistant.components.binary_sensor.device_trigger import CONF_MOTION, CONF_NO_MOTION
-# from homeassistant.components.deconz.device_trigger import CONF_SHORT_PRESS, CONF_LONG_PRESS
-
-from functools import cache
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import cache, lru_cache
+import hashlib
+import hmac
+import importlib
+import json
 import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import rdflib
 from rdflib import Literal, Graph, URIRef
 from rdflib.namespace import Namespace, RDF, RDFS, OWL, XSD
 from typing import Optional
 
-from ConfigSource import CLISource
+from AsyncConfigSource import AsyncConfigSource
+from ConfigSource import CLISource, SnapshotSource, writeAtomically
+from CompactStore import CompactStore
+from ExportProgress import ExportProgress
+from ExportState import ExportState, fingerprint
+from LazyModule import LazyModule, dumpConstants, loadConstants
+from NTriplesWriter import NTriplesWriter
+from PhaseProfiler import PhaseProfiler
+from TermCache import TermCache
+from ValidationCache import ValidationCache
+
+# The modules from this repository that shape our output, see `sourceFingerprint`:
+HELPER_MODULES = ["AsyncConfigSource", "CompactStore", "ConfigSource", "ExportState", "LazyModule", "NTriplesWriter",
+                  "TermCache", "ValidationCache"]
+
+# Importing homeassistant takes seconds, so we only import what an export actually uses. With a snapshot of HA's
+#  constants from `--dump-constants`, exports that don't validate automations don't need to import it at all.
+if os.getenv('HOWL_HA_CONSTANTS'):
+    loadConstants(os.getenv('HOWL_HA_CONSTANTS'))
+hc = LazyModule("homeassistant.const")
+ha_trigger = LazyModule("homeassistant.helpers.trigger")
+cv = LazyModule("homeassistant.helpers.config_validation")
+selector = LazyModule("homeassistant.helpers.selector")
+automation = LazyModule("homeassistant.components.automation")
+binary_sensor = LazyModule("homeassistant.components.binary_sensor")
+button = LazyModule("homeassistant.components.button")
+climate = LazyModule("homeassistant.components.climate")
+device_automation = LazyModule("homeassistant.components.device_automation")
+fan = LazyModule("homeassistant.components.fan")
+light = LazyModule("homeassistant.components.light")
+mqtt = LazyModule("homeassistant.components.mqtt")
+remote = LazyModule("homeassistant.components.remote")
+sensor = LazyModule("homeassistant.components.sensor")
+sun = LazyModule("homeassistant.components.sun")
+switch = LazyModule("homeassistant.components.switch")
+zone = LazyModule("homeassistant.components.zone")
+# What `--dump-constants` snapshots, including the submodules we take constants from:
+CONSTANT_MODULES = [m._name for m in [hc, ha_trigger, cv, selector, automation, binary_sensor, button, climate,
+                                      device_automation, fan, light, mqtt, remote, sensor, sun, switch, zone]] + [
+    "homeassistant.components.automation.const", "homeassistant.components.climate.const",
+    "homeassistant.components.device_automation.toggle_entity", "homeassistant.components.light.device_action",
+    "homeassistant.components.mqtt.device_trigger", "homeassistant.components.sun.const",
+    "homeassistant.components.zone.const"]
+
+
+def split_entity_id(entity_id):
+    # Same as `homeassistant.core.split_entity_id`, which isn't worth importing `homeassistant.core` for.
+    domain, _, object_id = entity_id.partition(".")
+    if not domain or not object_id:
+        raise ValueError(f"Invalid entity ID {entity_id}")
+    return domain, object_id
 
 
 class PrivacyFilter:
-    p_counter = 0  # Used to enumerate privatized entity names
     privacy_filter = None
 
-    def __init__(self, cs):
+    def __init__(self, cs, secret=None, terms=None):
         self.cs = cs
+        self.terms = TermCache() if terms is None else terms
+        # Pseudonyms are keyed hashes, so they're stable across runs and independent of processing order.
+        #  Keep the secret for your deployment in the environment, otherwise they're only stable within this run.
+        if secret is None:
+            secret = os.getenv('HOWL_PRIVACY_SECRET')
+        if secret is None:
+            secret = os.urandom(32)
+            self.ephemeral = True
+        else:
+            self.ephemeral = False
+        self.secret = secret.encode() if isinstance(secret, str) else secret
+
+    def pseudonym(self, platform, real_id):
+        return hmac.new(self.secret, f"{platform}:{real_id}".encode(), hashlib.sha256).hexdigest()[:16]
 
     def privacyFilter_init(self, privacy=None):
         # BEGIN Privacy settings:
@@ -72,45 +113,336 @@ class PrivacyFilter:
         # Log what we're doing:
         msg = "ALL" if self.privacy_filter is None else str(self.privacy_filter)
         logging.info(f"Preserving entities: {msg}")
+        if self.privacy_filter is not None and self.ephemeral:
+            logging.warning("HOWL_PRIVACY_SECRET is not set, pseudonyms will differ between runs.")
 
     def mkEntityURI(self, MINE, entity_id) -> tuple[URIRef, str]:
+        return self.terms.get("entity", (MINE, entity_id), lambda: self._mkEntityURI(MINE, entity_id))
+
+    def _mkEntityURI(self, MINE, entity_id):
         # TODO: Not sure what we want to assume here for uniqueness...probably want to keep domain.name instead of
         #  discarding it? Note that adding may happen somewhere else, as does setting a `friendly name` if it exists.
         try:
-            e_platform, e_name = ha.split_entity_id(entity_id)
+            e_platform, e_name = split_entity_id(entity_id)
             # we use a white-list in the privacy filter:
             if self.privacy_filter is not None and e_platform not in self.privacy_filter:
-                e_name = "entity_" + str(self.p_counter)
-                self.p_counter = self.p_counter + 1
+                e_name = "entity_" + self.pseudonym(e_platform, e_name)
             return MINE["entity/" + e_platform + "_" + mkname(e_name)], e_name
         except:
             logging.fatal(f"Can't process URI {entity_id}.")
             raise
 
     def mkLocationURI(self, MINE, name):
+        return self.terms.get("area", (MINE, name), lambda: self._mkLocationURI(MINE, name))
+
+    def _mkLocationURI(self, MINE, name):
+        if name not in self.cs.getAreas():
+            logging.warning(f"Unknown area {name}.")
         if self.privacy_filter is not None and "area" not in self.privacy_filter:
-            name = "entity_" + str(self.p_counter)
-            self.p_counter = self.p_counter + 1
+            name = "area_" + self.pseudonym("area", name)
         return MINE["area/" + mkname(name)]
 
     def mkDevice(self, MINE, device_id):
+        return self.terms.get("device", (MINE, device_id), lambda: self._mkDevice(MINE, device_id))
+
+    def _mkDevice(self, MINE, device_id):
         d2_name = self.cs.getDeviceAttr(device_id, 'name')
         d2_name_by_user = "None"
         if self.privacy_filter is not None and "device" not in self.privacy_filter:
-            d2_name = "device_" + str(self.p_counter)
-            p_counter = self.p_counter + 1
+            d2_name = "device_" + self.pseudonym("device", device_id)
         else:
             # TODO: Defer this in favour of RDFS.label
             d2_name_by_user = self.cs.getDeviceAttr(device_id, 'name_by_user')
         return MINE[mkname(d2_name if d2_name_by_user == "None" else d2_name_by_user)]
 
 
+@lru_cache(maxsize=1 << 16, typed=True)  # typed, since `1` and `1.0` are different names.
 def mkname(name):
     if isinstance(name, (int, float)):
         name = str(name)
     return name.replace(" ", "_").replace("/", "_")
 
 
+SAREF_CORE_URL = "https://saref.etsi.org/core/v3.1.1/saref.ttl"
+
+
+def cacheDir():
+    # Shared by all runs and (Celery-)workers on this host.
+    d = os.getenv('HOWL_CACHE_DIR', os.path.join(os.path.expanduser("~"), ".cache", "howl"))
+    os.makedirs(d, exist_ok=True)
+    return d
+
+
+@cache
+def sourceFingerprint():
+    # Cached results are only valid for the code that produced them: us and our helpers from this repository.
+    h = hashlib.sha256()
+    for name in ["hacvt"] + HELPER_MODULES:
+        module = sys.modules[__name__] if name == "hacvt" else sys.modules[name]
+        with open(module.__file__, "rb") as f:
+            h.update(name.encode() + b"\n" + hashlib.sha256(f.read()).digest())
+    return h.hexdigest()
+
+
+@cache
+def loadSAREF():
+    # Downloading and parsing SAREF on each run is slow, and impossible on air-gapped hosts.
+    # We keep the triples as N-Triples in the cache: plain data, which is safe to load even if someone else
+    #  wrote it, and quick to parse. The name depends on what we parsed (the content of a `HOWL_SAREF` copy, or
+    #  the versioned URL) and on rdflib, so a different source or rdflib never sees a stale cache.
+    # `HOWL_SAREF` can point to a vendored copy of saref.ttl instead of fetching it on first use.
+    source = os.getenv('HOWL_SAREF', SAREF_CORE_URL)
+    key = hashlib.sha256(rdflib.__version__.encode() + b"\n")
+    if os.path.exists(source):
+        with open(source, "rb") as f:
+            key.update(f.read())
+    else:
+        key.update(source.encode())
+    path = os.path.join(cacheDir(), f"saref-{key.hexdigest()[:16]}.nt")
+    master = Graph()
+    try:
+        master.parse(path, format="nt")
+        return master
+    except FileNotFoundError:
+        pass
+    except Exception as e:  # Whatever is wrong with it, we can rebuild it.
+        logging.warning(f"Ignoring broken ontology cache {path}: {e}")
+        master = Graph()
+    logging.info(f"Loading SAREF from {source}...")
+    master.parse(source, format="turtle")
+    writeAtomically(path, master.serialize(format="nt", encoding="utf-8"))
+    return master
+
+
+_parallel_build = None  # Set by `HACVT.buildInParallel` before forking workers.
+
+
+def _buildUnit(key):
+    u = Graph()
+    _parallel_build(key, u)
+    return u.serialize(format='nt')
+
+
+# Handlers for actions and triggers in automations, looked up once per action/trigger instead of if-chains.
+# Actions are keyed by (action type, domain), where the domain is only set for device actions (and `None`
+#  otherwise), triggers by their platform. Register your own, e.g. from a `--plugin`, with
+#  `registerAction` and `registerTrigger`.
+# Action handlers are called as `handler(tool, pf, HASS, MINE, g, o_action_instance, config)`,
+#  trigger handlers as `handler(tool, pf, HASS, MINE, g, o_trigger, t)`.
+ACTION_HANDLERS = {}
+TRIGGER_HANDLERS = {}
+PLATFORMS = frozenset(str(p) for p in hc.Platform)
+
+
+def registerAction(action_type, handler, domain=None, schema=None):
+    # `schema` validates the config before it's handed to the `handler`. A `handler` of `None` skips the action.
+    ACTION_HANDLERS[(action_type, domain)] = None if handler is None else (schema, handler)
+
+
+def registerTrigger(platform, handler):
+    TRIGGER_HANDLERS[platform] = handler
+
+
+def handlerFingerprint():
+    # Units built with handlers from `--plugin`s are only valid for the plugins (and their versions) that built them.
+    handlers = [h for _, h in filter(None, ACTION_HANDLERS.values())] + list(TRIGGER_HANDLERS.values())
+    parts = []
+    for name in sorted({h.__module__ for h in handlers} - {__name__, "hacvt"}):
+        path = getattr(sys.modules.get(name), '__file__', None)
+        if path is None:
+            parts.append((name, None))
+            continue
+        with open(path, "rb") as f:
+            parts.append((name, hashlib.sha256(f.read()).hexdigest()))
+    return parts
+
+
+def callServiceAction(tool, pf, HASS, MINE, g, o_action_instance, an_action):
+    # TODO: use schema in Python...SERVICE_SCHEMA
+    # The big problem is that there are tons of modules bringing their own stuff where
+    #  HA essentially uses reflection at runtime to deal with them e.g. in the UI.
+    # If we want a stable static schema, the only way forward would be to try and integrate
+    #  INTO HA, and try to intercept schemata etc. when a plugin checks in on startup.
+    # It's unclear to me if that would work, and would require deeper digging.
+    #
+    # The cv.* below is what is prescribed by HA, and maybe we don't have to dig deeper
+    #  than `target`
+    # TODO: Everythign here is optional...
+    if cv.CONF_TARGET in an_action and cv.CONF_SERVICE in an_action:
+        service_id = an_action[cv.CONF_SERVICE]
+        target = an_action[cv.CONF_TARGET]
+        tool.process_target_schema(pf, HASS, MINE, g, o_action_instance, service_id, target)
+
+
+def delayAction(tool, pf, HASS, MINE, g, o_action_instance, an_action):
+    g.add((o_action_instance, HASS['delay'],  # sloppy
+           Literal(str(cv.time_period(an_action[cv.CONF_DELAY])))))
+
+
+def buttonAction(tool, pf, HASS, MINE, g, o_action_instance, config):
+    e_id, _ = pf.mkEntityURI(MINE, config[cv.CONF_ENTITY_ID])
+    g.add((o_action_instance, HASS['press'], e_id))
+
+
+def climateAction(tool, pf, HASS, MINE, g, o_action_instance, config):
+    c = climate.device_action._ACTION_SCHEMA(config)
+    # dispatch on ACTION_TYPE, assemble action based on entity/mode:
+    _, e_name = split_entity_id(c[hc.CONF_ENTITY_ID])
+    name = mkname(e_name) + "_" + c[hc.CONF_TYPE]
+    # TODO: should be intermediate object? Or subclassing?
+    my_service = MINE["service/" + name.title()]
+    g.add((o_action_instance, HASS['target'], my_service))
+    # Modelling happening here:
+    g.add((my_service, RDFS.subClassOf, HASS["Climate_Mode"]))
+    if c[hc.CONF_TYPE] == "set_hvac_mode":
+        mode = c[climate.ATTR_HVAC_MODE]
+        # Sloppy, should be enum:
+        g.add((my_service, HASS['mode'], Literal(mode)))
+    elif c[hc.CONF_TYPE] == "set_preset_mode":
+        mode = c[climate.ATTR_PRESET_MODE]
+        g.add((my_service, HASS['mode'], Literal(mode)))
+    else:
+        logging.fatal(f"Action Oops: {c}.")
+
+
+def toggleAction(tool, pf, HASS, MINE, g, o_action_instance, config):
+    # Obs: we can't call the toggle_entity-schema validator, since the action
+    #   may have contributed new things.
+    c = config  # device_automation.toggle_entity.ACTION_SCHEMA(config)
+
+    if c[hc.CONF_TYPE] in device_automation.toggle_entity.DEVICE_ACTION_TYPES:
+        _, e_name = split_entity_id(c[cv.CONF_ENTITY_ID])
+        name = mkname(e_name) + "_" + c[hc.CONF_TYPE]
+        # assert hasEntity(master, Namespace("http://my.name.spc/service/"), 'Service', name) is not None, name
+        # TODO: Why "service", not "action"?
+        g.add((o_action_instance, HASS['target'], MINE["service/" + name]))
+    else:
+        # Not for us here.
+        pass
+    return c[cv.CONF_ENTITY_ID], c[hc.CONF_TYPE]
+
+
+def lightAction(tool, pf, HASS, MINE, g, o_action_instance, config):
+    # "Inherits" from device_automation/toggle_entity
+    e_id, type = toggleAction(tool, pf, HASS, MINE, g, o_action_instance, config)
+    opt_flash = config[light.device_action.ATTR_FLASH] if light.device_action in config else None
+    opt_bright_pct = config[light.device_action.ATTR_BRIGHTNESS_PCT] if light.device_action in config else None
+    # TODO: Can model here! It looks like that you can set DECREASE and still set PCT > 10 :-)
+    if type == light.device_action.TYPE_BRIGHTNESS_DECREASE:
+        # default: -10
+        # TODO: Review with Fernando
+        # TODO: superclass + attributes
+        g.remove((o_action_instance, RDF.type, None))
+        g.add((o_action_instance, RDF.type, HASS['action/LIGHT_ACTION_CHANGE_BRIGHTNESS']))
+        g.add((o_action_instance, HASS['changeBrightnessBy'], Literal(opt_bright_pct if opt_bright_pct is not None else -10)))
+    elif type == light.device_action.TYPE_BRIGHTNESS_INCREASE:
+        # default: +10
+        g.remove((o_action_instance, RDF.type, None))
+        g.add((o_action_instance, RDF.type, HASS['action/LIGHT_ACTION_CHANGE_BRIGHTNESS']))
+        g.add((o_action_instance, HASS['changeBrightnessBy'], Literal(opt_bright_pct if opt_bright_pct is not None else 10)))
+    elif type == light.device_action.TYPE_FLASH:
+        # default = short according to source.
+        g.remove((o_action_instance, RDF.type, None))
+        g.add((o_action_instance, RDF.type, HASS['action/LIGHT_ACTION_FLASH']))
+        g.add((o_action_instance, HASS['flashLength'], Literal(opt_flash if opt_flash is not None else "short")))
+    else:
+        # TODO: Lift "toggle".
+        logging.fatal(f"Unsupported type in: {config}")
+
+
+# Keys are spelled out instead of using e.g. `cv.SCRIPT_ACTION_DELAY`, and schemas are only looked up when used,
+#  so that we don't import the modules defining them before we have to.
+registerAction("call_service", callServiceAction)  # cv.SCRIPT_ACTION_CALL_SERVICE
+registerAction("delay", delayAction)  # cv.SCRIPT_ACTION_DELAY
+# Device actions (cv.SCRIPT_ACTION_DEVICE_AUTOMATION), the schema prescribes only `device_id` and `domain`.
+# https://www.home-assistant.io/integrations/device_automation/
+registerAction("device", None, "binary_sensor")
+registerAction("device", buttonAction, "button", lambda c: button.device_action._ACTION_SCHEMA(c))
+registerAction("device", climateAction, "climate", lambda c: climate.device_action._ACTION_SCHEMA(c))
+# registerAction("device", fanAction, "fan", lambda c: fan.device_action.ACTION_SCHEMA(c))
+registerAction("device", lightAction, "light", lambda c: light.device_action._ACTION_SCHEMA(c))
+registerAction("device", None, "sensor")
+registerAction("device", toggleAction, "switch", lambda c: switch.device_action._ACTION_SCHEMA(c))  # Nothing more.
+
+
+# Still a bit unclear here. An Action Trigger schema is very general,
+#  whereas the concrete schemas like binary_sensor/device_trigger.py prescribe more elements,
+#  most importantly `entity_id`
+def deviceTrigger(tool, pf, HASS, MINE, g, o_trigger, t):
+    trigger_device = pf.mkDevice(MINE, t[hc.CONF_DEVICE_ID])
+    g.add((o_trigger, HASS['device'], trigger_device))
+    # We just pick up anything via reflection here without looking into it.
+    trigger_type = HASS["type/" + t[hc.CONF_TYPE].title()]  # TODO: static? May not be possible/effective,
+    # ...since there's no global super-container? This must be INSIDE Homeassistant! #5
+    # What I don't know is if the triggers etc. are installed even though you're not using the integration...
+    g.add((trigger_type, RDFS.subClassOf, HASS["type/TriggerType"]))
+    g.add((o_trigger, RDF.type, trigger_type))
+
+
+def zoneTrigger(tool, pf, HASS, MINE, g, o_trigger, t):
+    e_id = t[hc.CONF_ENTITY_ID]  # already done
+    e_zone = t[hc.CONF_ZONE]
+    o_zone, _ = pf.mkEntityURI(MINE, e_zone)
+    e_event = t[hc.CONF_EVENT]
+    trigger_type = HASS["type/ZoneTrigger"]
+    g.add((o_trigger, RDF.type, trigger_type))
+    tool.mkDirectAttribute(HASS, hc.CONF_EVENT, g, o_trigger, t)
+    g.add((o_trigger, HASS['zone'], o_zone))
+
+
+def stateTrigger(tool, pf, HASS, MINE, g, o_trigger, t):
+    trigger_type = HASS["type/StateTrigger"]
+    g.add((o_trigger, RDF.type, trigger_type))
+    g.add((o_trigger, HASS['from'], Literal(t['from'])))
+    g.add((o_trigger, HASS['to'], Literal(t['to'])))
+
+
+def numericStateTrigger(tool, pf, HASS, MINE, g, o_trigger, t):
+    trigger_type = HASS["type/NumericStateTrigger"]
+    g.add((o_trigger, RDF.type, trigger_type))
+    #             vol.Required(CONF_PLATFORM): "numeric_state",
+    #             vol.Required(CONF_ENTITY_ID): cv.entity_ids_or_uuids,
+    #             vol.Optional(CONF_BELOW): cv.NUMERIC_STATE_THRESHOLD_SCHEMA,
+    #             vol.Optional(CONF_ABOVE): cv.NUMERIC_STATE_THRESHOLD_SCHEMA,
+    #             vol.Optional(CONF_VALUE_TEMPLATE): cv.template,
+    #             vol.Optional(CONF_FOR): cv.positive_time_period_template,
+    #             vol.Optional(CONF_ATTRIBUTE): cv.match_all,
+    tool.mkDirectAttribute(HASS, hc.CONF_ABOVE, g, o_trigger, t)
+    tool.mkDirectAttribute(HASS, hc.CONF_BELOW, g, o_trigger, t)
+    tool.mkDirectAttribute(HASS, hc.CONF_ATTRIBUTE, g, o_trigger, t)
+
+
+def sunTrigger(tool, pf, HASS, MINE, g, o_trigger, t):
+    e_event = t[hc.CONF_EVENT]
+    offset = t[hc.CONF_OFFSET]
+    trigger_type = HASS["type/SunTrigger"]
+    g.add((o_trigger, RDF.type, trigger_type))
+    tool.mkDirectAttribute(HASS, hc.CONF_EVENT, g, o_trigger, t)
+    tool.mkDirectAttribute(HASS, hc.CONF_OFFSET, g, o_trigger, t)
+
+
+def mqttTrigger(tool, pf, HASS, MINE, g, o_trigger, t):
+    #         vol.Required(CONF_PLATFORM): mqtt.DOMAIN,
+    #         vol.Required(CONF_TOPIC): mqtt.util.valid_subscribe_topic_template,
+    #         vol.Optional(CONF_PAYLOAD): cv.template,
+    #         vol.Optional(CONF_VALUE_TEMPLATE): cv.template,
+    #         vol.Optional(CONF_ENCODING, default=DEFAULT_ENCODING): cv.string,
+    #         vol.Optional(CONF_QOS, default=DEFAULT_QOS): vol.All(
+    #             vol.Coerce(int), vol.In([0, 1, 2])
+    #         ),
+    trigger_type = HASS["type/MQTTTrigger"]
+    g.add((o_trigger, RDF.type, trigger_type))
+    tool.mkDirectAttribute(HASS, mqtt.device_trigger.CONF_TOPIC, g, o_trigger, t)
+
+
+registerTrigger("device", deviceTrigger)
+registerTrigger("zone", zoneTrigger)  # zone.const.DOMAIN
+registerTrigger("state", stateTrigger)
+registerTrigger("numeric_state", numericStateTrigger)
+registerTrigger("sun", sunTrigger)  # sun.const.DOMAIN
+registerTrigger("mqtt", mqttTrigger)
+
+
 # TODOs
 # - escape "/" in names!
 
@@ -118,111 +450,291 @@ class HACVT:
 
     def __init__(self, cs):
         self.cs = cs
-
-    def main(self, debug=logging.INFO, certificate=None, privacy=None, namespace="http://my.name.space/"):
+        # (graph, term)-pairs we've already declared, instead of querying the output graph:
+        self.declared = set()
+        # The same few thousand URIs are needed over and over again:
+        self.terms = TermCache()
+        self.validated = ValidationCache(maxsize=1 << 12)
+        self.profiler = PhaseProfiler()
+
+    def main(self, debug=logging.INFO, certificate=None, privacy=None, namespace="http://my.name.space/",
+             metamodel=True, previous=None, track=False, out=None, echo=False, jobs=1, store="default",
+             profiler=None, progress=None):
         logging.basicConfig(level=debug, format='%(levelname)s: %(message)s')
-        self.cs.ws = self.cs._ws_connect(certificate=certificate)
-        self.cs.ws_counter = 1
-
-        pf = PrivacyFilter(self.cs)
+        if profiler is not None:
+            self.profiler = profiler
+        prof = self.profiler
+        progress = ExportProgress() if progress is None else progress
+        progress.phase("connect")
+        with prof.phase("connect"):
+            self.cs.connect(certificate=certificate)
+        progress.total("devices", len(self.cs.getDeviceRegistry()))
+
+        pf = PrivacyFilter(self.cs, terms=self.terms)
         pf.privacyFilter_init(privacy=privacy)
-        g = Graph(bind_namespaces="core")
-        MINE, HASS, SAREF, S4BLDG, class_to_saref, master = self.setupSAREF(g, namespace, importsOnly=False)
-        # Save metamodel:
-        f_out = open("homeassistantcore.rdf", "w")
-        print(g.serialize(format='application/rdf+xml'), file=f_out)
-        # ... and get us a fresh graph:
-        g = Graph(bind_namespaces="core")
-        MINE, HASS, SAREF, S4BLDG, _, master = self.setupSAREF(g, namespace, importsOnly=True)
-        g.add((URIRef(str(MINE)), OWL.imports, URIRef(str(HASS))))
-
-        the_devices = self.cs.getDevices()
-        for d in the_devices:
-            d_g = pf.mkDevice(MINE, d)
-            # https://github.com/home-assistant/core/blob/dev/homeassistant/helpers/device_registry.py
-            # For these we don't have constants.
-            # TODO: table-based conversion, manufacturer -> hasManufacturer,
-            #  maybe with lambdas for transformation?
-            manufacturer = self.cs.getDeviceAttr(d, hc.ATTR_MANUFACTURER)
-            name = self.cs.getDeviceAttr(d, hc.ATTR_NAME)
-            model = self.cs.getDeviceAttr(d, hc.ATTR_MODEL)
-            # O'sama denn hier? TODO.
-            entry_type = self.cs.getDeviceAttr(d, 'entry_type')
-            if not entry_type == "None":
-                logging.info(f"Found {d} {name} as: {entry_type}")
-                g.add((d_g, HASS["entry_type"], Literal(entry_type)))
-
-            # We create a super-class from the model. Eg. we have identical light bulbs, or motion sensors, or...
-            d_super = MINE['device/' + mkname(manufacturer)+"_"+mkname(model)]
-            g.add((d_super, RDFS.subClassOf, SAREF['Device']))
-
-            # The following is of course already a design-decision. We just create a container w/o particular type.
-            # That's what the SAREF-people did in the windmill-example.
-            g.add((d_g, RDF.type, d_super))
-            # TODO: it feels a bit weird to slap values onto a (singleton-) type, so we do it on each instance.
-            #  Check with Fernando.
-            g.add((d_g, SAREF['hasManufacturer'], Literal(manufacturer)))
-            g.add((d_g, SAREF['hasModel'], Literal(model)))
-
-            # Handle 'Area' of devices. May be None.
-            # TODO: Entities can override this individually.
-            d_area = self.cs.getYAMLText(f'area_id("{d}")')
-            area_name = self.cs.getYAMLText(f'area_name("{d}")')
-            if not d_area == "None":  # Careful, string!
-                area = pf.mkLocationURI(MINE, d_area)
-                g.add((area, RDF.type, S4BLDG['BuildingSpace']))
-                g.add((area, S4BLDG['contains'], d_g))
-                if pf.privacy_filter is None or "area" in pf.privacy_filter:
-                  g.add((area, RDFS.label, Literal(area_name)))
-            # END Area
-
-            # Handle `via_device` if present.
-            via = self.cs.getDeviceAttr(d, hc.ATTR_VIA_DEVICE)
-            if via != "None":
-                # Matches construction of d_g above:
-                other = pf.mkDevice(MINE, via)
-                logging.info(f"Found via({d},{via})")
-                g.add((d_g, HASS['via_device'], other))
-            # END via_device
-
-            es = self.cs.getDeviceEntities(d)
-
-            if len(es) == 0:
-                logging.info(f"Device {name} does not have any entities?!")
-            # elif len(es) == 1:
-            #     # Only one device, let's special-case
-            #     eprint(f"WARN: Device {name} does only have a single entity {es[0]}.")
-            #     continue  # TODO
+        # Devices, orphan entities and automations are self-contained units that we may be able to
+        #  reuse from a previous export.
+        self.state = ExportState(self.settingsFingerprint(namespace, pf), previous=previous, track=track)
+        progress.phase("automation_configs")
+        with prof.phase("automation_configs"):
+            self.cs.prefetchAutomationConfigs(self.automationNeeded(self.state.previous))
+        if metamodel:
+            progress.phase("metamodel")
+            with prof.phase("metamodel"):
+                self.saveMetamodel(namespace)
+        # Now the instance:
+        progress.phase("instance")
+        with prof.phase("instance"):
+            g = Graph(store=CompactStore() if store == "compact" else store, bind_namespaces="core")
+            MINE, HASS, SAREF, S4BLDG, _, master = self.setupSAREF(g, namespace, importsOnly=True)
+            class_to_saref = HACVT.mkClassToSAREF(SAREF)
+            g.add((URIRef(str(MINE)), OWL.imports, URIRef(str(HASS))))
+
+        self.state.header(g)
+        if out is not None:
+            # Streaming: from here on everything goes straight to `out`. Sorted like the units, see `ExportState.unit`.
+            for t in sorted(g):
+                out.add(t)
+            g = out
+        def build_device(d, u):
+            with prof.unit("device", d):
+                self.handleDevice(pf, HASS, MINE, SAREF, S4BLDG, class_to_saref, d, u, master)
+
+        progress.phase("devices")
+        with prof.phase("devices"):
+            if jobs > 1:
+                fps = {d: self.deviceFingerprint(d) for d in self.cs.getDevices()} if self.state.track else {}
+                todo = [d for d in self.cs.getDevices() if not self.state.isReusable("device:" + d, fps.get(d))]
+                progress.done("devices", len(self.cs.getDevices()) - len(todo))
+                built = self.buildInParallel(todo, build_device, jobs, master, SAREF,
+                                             lambda: progress.done("devices"))
+                # Merge in the same order as a serial run:
+                for d in self.cs.getDevices():
+                    self.state.unit(g, "device:" + d, lambda: fps[d],
+                                    lambda u: u.parse(data=built[d], format='nt'))
             else:
-                # Create sub-devices
-
-                # Let's ignore those as spam for now.
-                # Note that we don't seem to see the underlying radio-properties RSSI, LQI
-                # that HA is hiding explicitly in the UI.
-                def checkName(n):
-                    assert n.count('.') == 1
-                    (_domain, e_name) = ha.split_entity_id(n)
-                    return not (e_name.endswith("_identify") or e_name.endswith("_identifybutton"))
-
-                for e in filter(checkName, es):
-                    e_d = self.handle_entity(pf, HASS, MINE, SAREF, class_to_saref, d, e, g, master)
-                    if e_d is not None:
-                        # Derived entities and helpers are their own devices:
-                        g.add((d_g, SAREF['consistsOf'], e_d))
+                for d in self.cs.getDevices():
+                    self.state.unit(g, "device:" + d, lambda: self.deviceFingerprint(d), lambda u: build_device(d, u))
+                    progress.done("devices")
 
+        orphans, automations = [], []
         for e in self.getEntitiesWODevice():
             # These have an empty inverse of `consistsOf`
-            platform, name = ha.split_entity_id(e['entity_id'])
+            platform, name = split_entity_id(e['entity_id'])
             # Not a constant?
-            if platform == automation.const.DOMAIN:
-                self.handleAutomation(pf, master, HASS, MINE, e['attributes'], name, g)
-            else:
-                self.handle_entity(pf, HASS, MINE, SAREF, class_to_saref, None, e['entity_id'], g, master)
-
-        # Print Turtle output both to console:
-        print(g.serialize(format='turtle'))
+            (automations if platform == automation.const.DOMAIN else orphans).append(e)
+        progress.total("automations", len(automations))
+        progress.phase("orphans")
+        with prof.phase("orphans"):
+            for e in orphans:
+                self.state.unit(g, "entity:" + e['entity_id'], lambda: self.entityFingerprint(e['entity_id']),
+                                lambda u: self.handleOrphan(pf, HASS, MINE, SAREF, S4BLDG, class_to_saref,
+                                                            e['entity_id'], u, master))
+        progress.phase("automations")
+        with prof.phase("automations"):
+            for e in automations:
+                name = split_entity_id(e['entity_id'])[1]
+
+                def build_automation(u):
+                    with prof.unit("automation", e['entity_id']):
+                        self.handleAutomation(pf, master, HASS, MINE, e['attributes'], name, u)
+                self.state.unit(g, "automation:" + e['entity_id'], lambda: self.automationFingerprint(e),
+                                build_automation)
+                progress.done("automations")
+        if self.state.track:
+            logging.info(f"Rebuilt {self.state.rebuilt} units, reused {self.state.reused}.")
+        logging.info(self.terms.summary())
+        logging.info(self.validated.summary())
+        names = mkname.cache_info()
+        logging.info(f"mkname cache hits: {names.hits}/{names.hits + names.misses}")
+
+        if echo and out is None:
+            # Print Turtle output also to console:
+            print(g.serialize(format='turtle'))
         return g
 
+    def buildInParallel(self, devices, build_device, jobs, master, SAREF, done=lambda: None):
+        # Everything has been fetched by now, so building the graph is independent CPU-bound work per device.
+        # Workers are forked and inherit all (cached) data, only device ids and N-Triples cross process boundaries.
+        global _parallel_build
+        self.cs.getDeviceRegistry()
+        self.cs.getDeviceEntityIndex()
+        self.cs.getAreas()
+        self.cs.getStatesIndex()
+        self.cs.getServices()
+        HACVT.subclassIndex(master, SAREF, 'Property')
+        _parallel_build = build_device
+        if "fork" in multiprocessing.get_all_start_methods():
+            pool = ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("fork"))
+        else:
+            pool = ThreadPoolExecutor(max_workers=jobs)
+        with pool:
+            chunksize = max(1, len(devices) // (jobs * 4))
+            built = {}
+            # Results arrive in order, so we can report progress as we go:
+            for d, nt in zip(devices, pool.map(_buildUnit, devices, chunksize=chunksize)):
+                built[d] = nt
+                done()
+            return built
+
+    def handleDevice(self, pf, HASS, MINE, SAREF, S4BLDG, class_to_saref, d, g, master):
+        d_g = pf.mkDevice(MINE, d)
+        # https://github.com/home-assistant/core/blob/dev/homeassistant/helpers/device_registry.py
+        # For these we don't have constants.
+        # TODO: table-based conversion, manufacturer -> hasManufacturer,
+        #  maybe with lambdas for transformation?
+        manufacturer = self.cs.getDeviceAttr(d, hc.ATTR_MANUFACTURER)
+        name = self.cs.getDeviceAttr(d, hc.ATTR_NAME)
+        model = self.cs.getDeviceAttr(d, hc.ATTR_MODEL)
+        # O'sama denn hier? TODO.
+        entry_type = self.cs.getDeviceAttr(d, 'entry_type')
+        if not entry_type == "None":
+            logging.info(f"Found {d} {name} as: {entry_type}")
+            g.add((d_g, HASS["entry_type"], Literal(entry_type)))
+
+        # We create a super-class from the model. Eg. we have identical light bulbs, or motion sensors, or...
+        d_super = MINE['device/' + mkname(manufacturer)+"_"+mkname(model)]
+        g.add((d_super, RDFS.subClassOf, SAREF['Device']))
+
+        # The following is of course already a design-decision. We just create a container w/o particular type.
+        # That's what the SAREF-people did in the windmill-example.
+        g.add((d_g, RDF.type, d_super))
+        # TODO: it feels a bit weird to slap values onto a (singleton-) type, so we do it on each instance.
+        #  Check with Fernando.
+        g.add((d_g, SAREF['hasManufacturer'], Literal(manufacturer)))
+        g.add((d_g, SAREF['hasModel'], Literal(model)))
+
+        # Handle 'Area' of devices. May be None.
+        d_area = self.cs.getDeviceAttr(d, 'area_id')
+        if not d_area == "None":  # Careful, string!
+            area = self.mkArea(pf, MINE, g, d_area)
+            g.add((area, RDF.type, S4BLDG['BuildingSpace']))
+            g.add((area, S4BLDG['contains'], d_g))
+        # END Area
+
+        # Handle `via_device` if present.
+        via = self.cs.getDeviceAttr(d, hc.ATTR_VIA_DEVICE)
+        if via != "None":
+            # Matches construction of d_g above:
+            other = pf.mkDevice(MINE, via)
+            logging.info(f"Found via({d},{via})")
+            g.add((d_g, HASS['via_device'], other))
+        # END via_device
+
+        es = self.cs.getDeviceEntities(d)
+
+        if len(es) == 0:
+            logging.info(f"Device {name} does not have any entities?!")
+        # elif len(es) == 1:
+        #     # Only one device, let's special-case
+        #     eprint(f"WARN: Device {name} does only have a single entity {es[0]}.")
+        #     continue  # TODO
+        else:
+            # Create sub-devices
+
+            # Let's ignore those as spam for now.
+            # Note that we don't seem to see the underlying radio-properties RSSI, LQI
+            # that HA is hiding explicitly in the UI.
+            def checkName(n):
+                assert n.count('.') == 1
+                (_domain, e_name) = split_entity_id(n)
+                return not (e_name.endswith("_identify") or e_name.endswith("_identifybutton"))
+
+            for e in filter(checkName, es):
+                e_d = self.handle_entity(pf, HASS, MINE, SAREF, class_to_saref, d, e, g, master)
+                if e_d is not None:
+                    # Derived entities and helpers are their own devices:
+                    g.add((d_g, SAREF['consistsOf'], e_d))
+                    # Entities can override the area of their device individually:
+                    e_area = self.cs.getEntityAreaId(e)
+                    if e_area != "None" and e_area != d_area:
+                        area = self.mkArea(pf, MINE, g, e_area)
+                        g.add((area, RDF.type, S4BLDG['BuildingSpace']))
+                        g.add((area, S4BLDG['contains'], e_d))
+
+    def handleOrphan(self, pf, HASS, MINE, SAREF, S4BLDG, class_to_saref, e, g, master):
+        e_d = self.handle_entity(pf, HASS, MINE, SAREF, class_to_saref, None, e, g, master)
+        e_area = self.cs.getEntityAreaId(e)
+        if e_d is not None and e_area != "None":
+            area = self.mkArea(pf, MINE, g, e_area)
+            g.add((area, RDF.type, S4BLDG['BuildingSpace']))
+            g.add((area, S4BLDG['contains'], e_d))
+
+    # The attributes that `handle_entity` looks at (for climate only whether they are present):
+    ENTITY_ATTRIBUTES = ('device_class', hc.ATTR_FRIENDLY_NAME, 'supported_features', 'unit_of_measurement')
+    ENTITY_PRESENT_ATTRIBUTES = ('current_temperature', 'current_humidity')
+
+    def entityFingerprintParts(self, e):
+        attrs = self.cs.getAttributes(e)
+        return (self.cs.getEntityRegistry().get(e),
+                {k: attrs[k] for k in HACVT.ENTITY_ATTRIBUTES if k in attrs},
+                [attrs.get(k) is not None for k in HACVT.ENTITY_PRESENT_ATTRIBUTES],
+                self.cs.getAreaName(self.cs.getEntityAreaId(e)))
+
+    def entityFingerprint(self, e):
+        return fingerprint(self.entityFingerprintParts(e))
+
+    def deviceFingerprint(self, d):
+        registry = self.cs.getDeviceRegistry()
+        via = registry.get(self.cs.getDeviceAttr(d, hc.ATTR_VIA_DEVICE))
+        return fingerprint(registry[d],
+                           # We're using the name of the other device:
+                           via and (via['name'], via['name_by_user']),
+                           self.cs.getAreaName(self.cs.getDeviceAttr(d, 'area_id')),
+                           [self.entityFingerprintParts(e) for e in self.cs.getDeviceEntities(d)])
+
+    def automationFingerprint(self, e):
+        # HA re-creates the state when an automation is (re)loaded, so `last_changed` tracks config changes
+        #  (unlike `last_updated`, which follows `last_triggered`).
+        attrs = {k: v for k, v in e['attributes'].items() if k not in ('last_triggered', 'current')}
+        return fingerprint(attrs, e.get('last_changed'), self.deviceNames(), self.cs.getAreas())
+
+    def automationNeeded(self, previous):
+        # Whether we have to build an automation from its config, or can reuse it from the `previous` export.
+        #  Should the settings have changed since, we fetch the configs that we skipped here when we need them.
+        if previous is None:
+            return lambda state: True
+        return lambda state: (previous.fingerprints.get("automation:" + state['entity_id'])
+                              != self.automationFingerprint(state))
+
+    @cache
+    def deviceNames(self):
+        # Automations refer to devices by their names.
+        return {d: (r['name'], r['name_by_user']) for d, r in self.cs.getDeviceRegistry().items()}
+
+    def settingsFingerprint(self, namespace, pf):
+        # Changes here invalidate all units. A different privacy secret changes all pseudonyms.
+        return fingerprint(namespace, pf.privacy_filter and sorted(pf.privacy_filter), pf.pseudonym("settings", ""),
+                           self.cs.getServices(), sourceFingerprint(), handlerFingerprint())
+
+    def metamodelFingerprint(self, namespace):
+        # The metamodel only depends on HA's version, this instance's services, and of course on us.
+        services = {d: sorted(svcs) for d, svcs in self.cs.getServices().items()}
+        return fingerprint(hc.__version__, services, namespace, sourceFingerprint())
+
+    def saveMetamodel(self, namespace, path="homeassistantcore.rdf"):
+        cached = os.path.join(cacheDir(), f"homeassistantcore-{self.metamodelFingerprint(namespace)}.rdf")
+        if os.path.exists(cached):
+            logging.info(f"Reusing metamodel {cached}.")
+        else:
+            g = Graph(bind_namespaces="core")
+            self.setupSAREF(g, namespace, importsOnly=False)
+            writeAtomically(cached, (g.serialize(format='application/rdf+xml') + "\n").encode())
+        shutil.copyfile(cached, path)
+
+    async def main_async(self, **kwargs):
+        # Needs an AsyncConfigSource: fetch everything concurrently first, then build the graph from memory.
+        # `main` runs in a thread here, and forking a multi-threaded process for `jobs` isn't safe:
+        assert kwargs.get('jobs', 1) == 1, "Can't build in parallel with the AsyncConfigSource."
+        if kwargs.get('profiler') is not None:
+            self.profiler = kwargs['profiler']
+        if kwargs.get('progress') is not None:
+            kwargs['progress'].phase("prefetch")
+        with self.profiler.phase("prefetch"):
+            await self.cs.prefetch(self.automationNeeded(kwargs.get('previous')))
+        # Whatever wasn't prefetched (e.g. templates) is still fetched with blocking calls, so not on the event loop:
+        return await asyncio.to_thread(self.main, **kwargs)
+
     def handleAutomation(self, pf, master, HASS, MINE, a, a_name, g):
         logging.debug(f"Handling automation {a_name}...")
         c_trigger = 0
@@ -245,14 +757,14 @@ class HACVT:
         for an_action in the_actions:
             # Convert back to its type:
             try:
-                the_action = cv.determine_script_action(an_action)
+                the_action = self.validated.validate("action type", cv.determine_script_action, an_action)
             except ValueError:
                 logging.error(f'Couldn\'t handle action {an_action}')
                 raise
             # This call seems to perform some lifting, e.g. in cases where a one-element list
             #  would be a single element in JSON, but the code would like to work with the list.
             # assert cv.script_action(an_action) == an_action, (an_action, cv.script_action(an_action))
-            an_action = cv.script_action(an_action)
+            an_action = self.validated.validate("action", cv.script_action, an_action)
             # TODO: assert HASS[the_action] already exists since we should have the schema.
             # But no worky:
             # assert hasEntity(master, Namespace("http://home-assistant.io/action/"), 'Action', the_action), the_action
@@ -261,117 +773,23 @@ class HACVT:
             g.add((o_action_instance, RDF.type, o_action))
             g.add((a_o, HASS['consistsOf'], o_action_instance))  # TODO: XXX create multiplicity+order in schema
             i = i + 1
-            if the_action == cv.SCRIPT_ACTION_CALL_SERVICE:
-                # TODO: use schema in Python...SERVICE_SCHEMA
-                # The big problem is that there are tons of modules bringing their own stuff where
-                #  HA essentially uses reflection at runtime to deal with them e.g. in the UI.
-                # If we want a stable static schema, the only way forward would be to try and integrate
-                #  INTO HA, and try to intercept schemata etc. when a plugin checks in on startup.
-                # It's unclear to me if that would work, and would require deeper digging.
-                #
-                # The cv.* below is what is prescribed by HA, and maybe we don't have to dig deeper
-                #  than `target`
-                # TODO: Everythign here is optional...
-                if cv.CONF_TARGET in an_action and cv.CONF_SERVICE in an_action:
-                    service_id = an_action[cv.CONF_SERVICE]
-                    target = an_action[cv.CONF_TARGET]
-                    self.process_target_schema(pf, HASS, MINE, g, o_action_instance, service_id, target)
-
-            elif the_action == cv.SCRIPT_ACTION_DEVICE_AUTOMATION:
-                # Schema prescribes only `device_id` and `domain`.
-                # https://www.home-assistant.io/integrations/device_automation/
+            if the_action == cv.SCRIPT_ACTION_DEVICE_AUTOMATION:
                 device = pf.mkDevice(MINE, an_action[cv.CONF_DEVICE_ID])
                 g.add((o_action_instance, HASS['device'], device))
-
-                def button_action(config):
-                    e_id, _ = pf.mkEntityURI(MINE, an_action[cv.CONF_ENTITY_ID])
-                    g.add((o_action_instance, HASS['press'], e_id))
-
-                def climate_action(config):
-                    c = climate.device_action._ACTION_SCHEMA(config)
-                    # dispatch on ACTION_TYPE, assemble action based on entity/mode:
-                    _, e_name = ha.split_entity_id(c[hc.CONF_ENTITY_ID])
-                    name = mkname(e_name) + "_" + c[hc.CONF_TYPE]
-                    # TODO: should be intermediate object? Or subclassing?
-                    my_service = MINE["service/" + name.title()]
-                    g.add((o_action_instance, HASS['target'], my_service))
-                    # Modelling happening here:
-                    g.add((my_service, RDFS.subClassOf, HASS["Climate_Mode"]))
-                    if c[hc.CONF_TYPE] == "set_hvac_mode":
-                        mode = c[climate.ATTR_HVAC_MODE]
-                        # Sloppy, should be enum:
-                        g.add((my_service, HASS['mode'], Literal(mode)))
-                    elif c[hc.CONF_TYPE] == "set_preset_mode":
-                        mode = c[climate.ATTR_PRESET_MODE]
-                        g.add((my_service, HASS['mode'], Literal(mode)))
-                    else:
-                        logging.fatal(f"Action Oops: {c}.")
-                    pass
-
-                def toggle_action(config):
-                    # Obs: we can't call the toggle_entity-schema validator, since the action
-                    #   may have contributed new things.
-                    c = config  # device_automation.toggle_entity.ACTION_SCHEMA(config)
-
-                    if c[hc.CONF_TYPE] in device_automation.toggle_entity.DEVICE_ACTION_TYPES:
-                        _, e_name = ha.split_entity_id(c[cv.CONF_ENTITY_ID])
-                        name = mkname(e_name) + "_" + c[hc.CONF_TYPE]
-                        # assert hasEntity(master, Namespace("http://my.name.spc/service/"), 'Service', name) is not None, name
-                        # TODO: Why "service", not "action"?
-                        g.add((o_action_instance, HASS['target'], MINE["service/" + name]))
-                    else:
-                        # Not for us here.
-                        pass
-                    return c[cv.CONF_ENTITY_ID], c[hc.CONF_TYPE]
-
-                def light_action(config):
-                    # "Inherits" from device_automation/toggle_entity
-                    e_id, type = toggle_action(config)
-                    opt_flash = config[light.device_action.ATTR_FLASH] if light.device_action in config else None
-                    opt_bright_pct = config[light.device_action.ATTR_BRIGHTNESS_PCT] if light.device_action in config else None
-                    # TODO: Can model here! It looks like that you can set DECREASE and still set PCT > 10 :-)
-                    if type == light.device_action.TYPE_BRIGHTNESS_DECREASE:
-                        # default: -10
-                        # TODO: Review with Fernando
-                        # TODO: superclass + attributes
-                        g.remove((o_action_instance, RDF.type, None))
-                        g.add((o_action_instance, RDF.type, HASS['action/LIGHT_ACTION_CHANGE_BRIGHTNESS']))
-                        g.add((o_action_instance, HASS['changeBrightnessBy'], Literal(opt_bright_pct if opt_bright_pct is not None else -10)))
-                    elif type == light.device_action.TYPE_BRIGHTNESS_INCREASE:
-                        # default: +10
-                        g.remove((o_action_instance, RDF.type, None))
-                        g.add((o_action_instance, RDF.type, HASS['action/LIGHT_ACTION_CHANGE_BRIGHTNESS']))
-                        g.add((o_action_instance, HASS['changeBrightnessBy'], Literal(opt_bright_pct if opt_bright_pct is not None else 10)))
-                    elif type == light.device_action.TYPE_FLASH:
-                        # default = short according to source.
-                        g.remove((o_action_instance, RDF.type, None))
-                        g.add((o_action_instance, RDF.type, HASS['action/LIGHT_ACTION_FLASH']))
-                        g.add((o_action_instance, HASS['flashLength'], Literal(opt_flash if opt_flash is not None else "short")))
-                    else:
-                        # TODO: Lift "toggle".
-                        logging.fatal(f"Unsupported type in: {config}")
-
-                action_table = {
-                    hc.Platform.BINARY_SENSOR: None,
-                    hc.Platform.BUTTON: (button.device_action._ACTION_SCHEMA, button_action),
-                    hc.Platform.CLIMATE: (climate.device_action._ACTION_SCHEMA, climate_action),
-                    # hc.Platform.FAN: (fan.device_action.ACTION_SCHEMA, fan_action),
-                    hc.Platform.LIGHT: (light.device_action._ACTION_SCHEMA, light_action),
-                    hc.Platform.SENSOR: None,
-                    hc.Platform.SWITCH: (switch.device_action._ACTION_SCHEMA, toggle_action),  # Nothing more.
-                }
-                if an_action[cv.CONF_DOMAIN] not in action_table:
-                    logging.error(f"Skipping action domain {an_action[cv.CONF_DOMAIN]}.")
-                else:
-                    schema, action = action_table[an_action[cv.CONF_DOMAIN]]
-                    if action is not None:
-                        # And off we go!
-                        action(schema(an_action))
-            elif the_action == cv.SCRIPT_ACTION_DELAY:
-                g.add((o_action_instance, HASS['delay'],  # sloppy
-                       Literal(str(cv.time_period(an_action[cv.CONF_DELAY])))))
+                key = (the_action, an_action[cv.CONF_DOMAIN])
             else:
-                logging.warning("Skipping action " + the_action + ":" + str(an_action))  # TODO
+                key = (the_action, None)
+            if key not in ACTION_HANDLERS:
+                if key[1] is not None:
+                    logging.error(f"Skipping action domain {key[1]}.")
+                else:
+                    logging.warning("Skipping action " + the_action + ":" + str(an_action))  # TODO
+            elif ACTION_HANDLERS[key] is not None:
+                schema, handler = ACTION_HANDLERS[key]
+                if schema is not None:
+                    an_action = self.validated.validate(key[1] + " action", schema, an_action)
+                # And off we go!
+                handler(self, pf, HASS, MINE, g, o_action_instance, an_action)
             # TODO: populate schema by action type
             # `action`s are governed by: https://github.com/home-assistant/core/blob/31a787558fd312331b55e5c2c4b33341fc3601fc/homeassistant/helpers/script.py#L270
             # After that it's following the `_SCHEMA`
@@ -382,13 +800,13 @@ class HACVT:
             the_triggers = a_config['triggers']
         for a_trigger in the_triggers:
             # https://www.home-assistant.io/docs/automation/trigger/
-            for t in cv.TRIGGER_SCHEMA(a_trigger):
+            for t in self.validated.validate("trigger", cv.TRIGGER_SCHEMA, a_trigger):
                 # Only `platform` is mandatory.
                 c_trigger = c_trigger + 1
-                if not any(x for x in hc.Platform if x.name == t[cv.CONF_PLATFORM]):
+                if t[cv.CONF_PLATFORM] not in PLATFORMS:
                     # These are some built-ins:
                     logging.debug(f"Checking platform `{t[cv.CONF_PLATFORM]}`")
-                    if not t[cv.CONF_PLATFORM] in _PLATFORM_ALIASES:
+                    if not t[cv.CONF_PLATFORM] in ha_trigger._PLATFORM_ALIASES:
                         logging.info(f"Found custom platform `{t[cv.CONF_PLATFORM]}`")
 
                 o_trigger = MINE["trigger/" + a_name + str(c_trigger)]
@@ -416,69 +834,13 @@ class HACVT:
                             # logged upstream already
                             pass
 
-                # Still a bit unclear here. An Action Trigger schema is very general,
-                #  whereas the concrete schemas like binary_sensor/device_trigger.py prescribe more elements,
-                #  most importantly `entity_id`
-                if t[cv.CONF_PLATFORM] == "device":
-                    trigger_device = pf.mkDevice(MINE, t[hc.CONF_DEVICE_ID])
-                    g.add((o_trigger, HASS['device'], trigger_device))
-                    # We just pick up anything via reflection here without looking into it.
-                    trigger_type = HASS["type/" + t[hc.CONF_TYPE].title()]  # TODO: static? May not be possible/effective,
-                    # ...since there's no global super-container? This must be INSIDE Homeassistant! #5
-                    # What I don't know is if the triggers etc. are installed even though you're not using the integration...
-                    g.add((trigger_type, RDFS.subClassOf, HASS["type/TriggerType"]))
-                    g.add((o_trigger, RDF.type, trigger_type))
-                elif t[cv.CONF_PLATFORM] == zone.const.DOMAIN:
-                    e_id = t[hc.CONF_ENTITY_ID]  # already done
-                    e_zone = t[hc.CONF_ZONE]
-                    o_zone, _ = pf.mkEntityURI(MINE, e_zone)
-                    e_event = t[hc.CONF_EVENT]
-                    trigger_type = HASS["type/ZoneTrigger"]
-                    g.add((o_trigger, RDF.type, trigger_type))
-                    self.mkDirectAttribute(HASS, hc.CONF_EVENT, g, o_trigger, t)
-                    g.add((o_trigger, HASS['zone'], o_zone))
-                elif t[hc.CONF_PLATFORM] == "state":
-                    trigger_type = HASS["type/StateTrigger"]
-                    g.add((o_trigger, RDF.type, trigger_type))
-                    g.add((o_trigger, HASS['from'], Literal(t['from'])))
-                    g.add((o_trigger, HASS['to'], Literal(t['to'])))
-                elif t[hc.CONF_PLATFORM] == "numeric_state":
-                    trigger_type = HASS["type/NumericStateTrigger"]
-                    g.add((o_trigger, RDF.type, trigger_type))
-                    #             vol.Required(CONF_PLATFORM): "numeric_state",
-                    #             vol.Required(CONF_ENTITY_ID): cv.entity_ids_or_uuids,
-                    #             vol.Optional(CONF_BELOW): cv.NUMERIC_STATE_THRESHOLD_SCHEMA,
-                    #             vol.Optional(CONF_ABOVE): cv.NUMERIC_STATE_THRESHOLD_SCHEMA,
-                    #             vol.Optional(CONF_VALUE_TEMPLATE): cv.template,
-                    #             vol.Optional(CONF_FOR): cv.positive_time_period_template,
-                    #             vol.Optional(CONF_ATTRIBUTE): cv.match_all,
-                    self.mkDirectAttribute(HASS, hc.CONF_ABOVE, g, o_trigger, t)
-                    self.mkDirectAttribute(HASS, hc.CONF_BELOW, g, o_trigger, t)
-                    self.mkDirectAttribute(HASS, hc.CONF_ATTRIBUTE, g, o_trigger, t)
-                elif t[cv.CONF_PLATFORM] == sun.const.DOMAIN:
-                    e_event = t[hc.CONF_EVENT]
-                    offset = t[hc.CONF_OFFSET]
-                    trigger_type = HASS["type/SunTrigger"]
-                    g.add((o_trigger, RDF.type, trigger_type))
-                    self.mkDirectAttribute(HASS, hc.CONF_EVENT, g, o_trigger, t)
-                    self.mkDirectAttribute(HASS, hc.CONF_OFFSET, g, o_trigger, t)
-                elif t[cv.CONF_PLATFORM] == "mqtt":
-                    #         vol.Required(CONF_PLATFORM): mqtt.DOMAIN,
-                    #         vol.Required(CONF_TOPIC): mqtt.util.valid_subscribe_topic_template,
-                    #         vol.Optional(CONF_PAYLOAD): cv.template,
-                    #         vol.Optional(CONF_VALUE_TEMPLATE): cv.template,
-                    #         vol.Optional(CONF_ENCODING, default=DEFAULT_ENCODING): cv.string,
-                    #         vol.Optional(CONF_QOS, default=DEFAULT_QOS): vol.All(
-                    #             vol.Coerce(int), vol.In([0, 1, 2])
-                    #         ),
-                    trigger_type = HASS["type/MQTTTrigger"]
-                    g.add((o_trigger, RDF.type, trigger_type))
-                    self.mkDirectAttribute(HASS, mqtt.device_trigger.CONF_TOPIC, g, o_trigger, t)
-                else:
+                handler = TRIGGER_HANDLERS.get(t[cv.CONF_PLATFORM])
+                if handler is None:
                     logging.warning(f"not handling trigger platform {t[cv.CONF_PLATFORM]}: {t}.")
                     g.add((o_trigger, RDF.type, HASS[f"trigger/{t[cv.CONF_PLATFORM].title()}"]))
                     g.add((HASS[f"trigger/{t[cv.CONF_PLATFORM].title()}"], RDFS.subClassOf, HASS['type/TriggerType']))
                     continue
+                handler(self, pf, HASS, MINE, g, o_trigger, t)
                 # TODO: investigate warning on line below
                 g.add((a_o, HASS['hasTrigger'], o_trigger))
 
@@ -488,9 +850,18 @@ class HACVT:
         else:
             the_conditions = a_config['conditions']
         for a_condition in the_conditions:
-            for c in cv.CONDITION_SCHEMA(a_condition):
+            for c in self.validated.validate("condition", cv.CONDITION_SCHEMA, a_condition):
                 pass  # TODO
 
+    def mkArea(self, pf, MINE, g, area_id):
+        # Areas are a small, fixed set that we get in bulk from the area registry.
+        area = pf.mkLocationURI(MINE, area_id)
+        if pf.privacy_filter is None or "area" in pf.privacy_filter:
+            area_name = self.cs.getAreaName(area_id)
+            if area_name != "None":
+                g.add((area, RDFS.label, Literal(area_name)))
+        return area
+
     def mkDirectAttribute(self, HASS, attribute, g, o_trigger, t):
         if attribute in t:
             g.add((o_trigger, HASS[attribute], Literal(t[attribute])))
@@ -501,8 +872,8 @@ class HACVT:
             for e in target[cv.ATTR_ENTITY_ID]:
                 # This is a little bit tricky where we diverge from HA's modelling:
                 #  We have a concrete instance already which corresponds to this particular pair of `service, target`.
-                _, t_name = ha.split_entity_id(e)
-                _, service_name = ha.split_entity_id(service_id)
+                _, t_name = split_entity_id(e)
+                _, service_name = split_entity_id(service_id)
                 target_entity = MINE["service/" + mkname(t_name) + "_" + service_name]
                 g.add((o_action_instance, HASS['target'], target_entity))
         if cv.ATTR_DEVICE_ID in target:
@@ -512,12 +883,12 @@ class HACVT:
         if cv.ATTR_AREA_ID in target:
             # untested:
             for a in target[cv.ATTR_AREA_ID]:
-                target_area = pf.mkLocationURI(MINE, a)
+                target_area = self.mkArea(pf, MINE, g, a)
                 g.add((o_action_instance, HASS['target'], target_area))
 
     @staticmethod
     def mkServiceURI(MINE, SAREF, service_id):
-        _, service_name = ha.split_entity_id(service_id)
+        _, service_name = split_entity_id(service_id)
         if service_name == hc.SERVICE_TURN_ON:  # dupe TODO
             e_service_instance = SAREF["SwitchOnService"]
         else:
@@ -527,7 +898,7 @@ class HACVT:
     def handle_entity(self, pf, HASS, MINE, SAREF, class_to_saref, device: Optional[str], e, g, master):
         logging.info(f"Handling {e} for device {device}.")
         assert e.count('.') == 1
-        (domain, e_name) = ha.split_entity_id(e)
+        (domain, e_name) = split_entity_id(e)
         # Experimental section:
         # e_friendly_name = getYAML(f'state_attr("{e}", "friendly_name")')
         # END
@@ -555,15 +926,15 @@ class HACVT:
                 c = super_class
             if super_class == SAREF['Sensor']:  # XXX?
                 # Special-casing (business rule):
-                if device_class == SensorDeviceClass.TEMPERATURE:
+                if device_class == sensor.SensorDeviceClass.TEMPERATURE:
                     c = SAREF["TemperatureSensor"]
                     # assert attrs['state_class'] == "measurement", attrs
-                elif device_class == SensorDeviceClass.HUMIDITY:
+                elif device_class == sensor.SensorDeviceClass.HUMIDITY:
                     # TODO. Do we want more subclasses here?
                     pass
                     # c = HASS['HumiditySensor']
                     # assert attrs['state_class'] == "measurement", attrs
-                elif device_class == SensorDeviceClass.ENERGY:
+                elif device_class == sensor.SensorDeviceClass.ENERGY:
                     c = SAREF['Meter']
                     # TODO -- probably we shouldn't be asserting those things.
                     # assert attrs['state_class'] == "total_increasing", attrs
@@ -576,7 +947,7 @@ class HACVT:
         e_d, e_name = pf.mkEntityURI(MINE, e)
         g.add((e_d, RDF.type, c))
         try:
-            friendly_name = self.cs.getAttributes(e)[hc.ATTR_FRIENDLY_NAME]
+            friendly_name = attrs[hc.ATTR_FRIENDLY_NAME]
             if pf.privacy_filter is None or e_d in pf.privacy_filter:
                 # Bad idea, but...:
                 g.add((e_d, RDFS.label, Literal(friendly_name)))
@@ -662,15 +1033,15 @@ class HACVT:
             q = attrs['unit_of_measurement'] if 'unit_of_measurement' in attrs else None
             if q is not None:
                 # TODO - more below. When is this complete? When we've either exhausted SAREF or HASS.
-                if device_class == SensorDeviceClass.TEMPERATURE:
+                if device_class == sensor.SensorDeviceClass.TEMPERATURE:
                     unit = SAREF['TemperatureUnit']
-                elif device_class == SensorDeviceClass.CURRENT:
+                elif device_class == sensor.SensorDeviceClass.CURRENT:
                     unit = SAREF['PowerUnit']
-                elif device_class == SensorDeviceClass.POWER:
+                elif device_class == sensor.SensorDeviceClass.POWER:
                     unit = SAREF['PowerUnit']
-                elif device_class == SensorDeviceClass.ENERGY:
+                elif device_class == sensor.SensorDeviceClass.ENERGY:
                     unit = SAREF['EnergyUnit']
-                elif device_class == SensorDeviceClass.PRESSURE:
+                elif device_class == sensor.SensorDeviceClass.PRESSURE:
                     unit = SAREF['PressureUnit']
                 else:  # Not built-in.
                     # TODO: check -- are we done here?
@@ -696,9 +1067,8 @@ class HACVT:
         if not (q_o is None):
             return q_o
         q_o = HASS[q]
-        uri = URIRef("http://home-assistant.io/" + q)
-        # TODO: is this worth the effort?
-        if len(list(g.triples((uri, None, None)))) == 0:
+        if (g.identifier, q_o) not in self.declared:
+            self.declared.add((g.identifier, q_o))
             logging.info(f"Creating {q}.")
             # Create Property...
             g.add((q_o, RDFS.subClassOf, SAREF['Property']))
@@ -730,18 +1100,64 @@ class HACVT:
 
     @staticmethod
     @cache
-    def hasEntity(graph, ns, cl, q):
-        # TODO: At least we're caching now...but we could precompute a dictionary.
+    def subclassIndex(graph, ns, cl):
+        # Suffix -> URI of all subclasses of `ns[cl]`, built once per (master-)graph.
         # Can't search in e.g. HA_ACTION?
+        index = {}
         for s, _, _ in graph.triples((None, RDFS.subClassOf, ns[cl])):
-            if s.endswith("/" + q):
-                return ns[q]
-        return None
+            suffix = str(s).rsplit("/", 1)[-1]
+            index[suffix] = ns[suffix]
+        return index
+
+    @staticmethod
+    def hasEntity(graph, ns, cl, q):
+        return HACVT.subclassIndex(graph, ns, cl).get(q)
+
+    @staticmethod
+    def mkClassToSAREF(SAREF):
+        # Let's patch SAREF a bit with our extensions:
+        # True/False could be replaced by having the HASS-ns on the RHS.
+        return {
+            hc.Platform.AIR_QUALITY: (True, SAREF["Sensor"]),
+            hc.Platform.ALARM_CONTROL_PANEL: (True, SAREF["Device"]),
+            hc.Platform.BINARY_SENSOR: (False, SAREF["Sensor"]),  # Modelling design decisions...
+            hc.Platform.BUTTON: (True, SAREF["Sensor"]),
+            hc.Platform.CALENDAR: None,
+            hc.Platform.CAMERA: (True, SAREF["Device"]),
+            hc.Platform.CLIMATE: (False, SAREF["HVAC"]),
+            hc.Platform.COVER: (True, SAREF["Actuator"]),  # ? saref4bldg:ShadingDevice
+            hc.Platform.DEVICE_TRACKER: (True, SAREF["Sensor"]),
+            hc.Platform.FAN: (True, SAREF["Appliance"]),
+            hc.Platform.GEO_LOCATION: None,
+            hc.Platform.HUMIDIFIER: (True, SAREF["Appliance"]),
+            hc.Platform.IMAGE_PROCESSING: None,
+            hc.Platform.LIGHT: (True, SAREF["Appliance"]),
+            hc.Platform.LOCK: (True, SAREF["Appliance"]),
+            # XXX Deprecated hc.Platform.MAILBOX: None,
+            hc.Platform.MEDIA_PLAYER: (True, SAREF["Appliance"]),
+            hc.Platform.NOTIFY: None,
+            hc.Platform.NUMBER: None,  # SERVICE_SET_VALUE
+            hc.Platform.REMOTE: (True, SAREF["Device"]),
+            hc.Platform.SCENE: None,
+            hc.Platform.SELECT: None,  # SERVICE_SELECT_OPTION
+            hc.Platform.SENSOR: (False, SAREF["Sensor"]),
+            hc.Platform.SIREN: (True, SAREF["Appliance"]),
+            hc.Platform.STT: None,
+            hc.Platform.SWITCH: (False, SAREF["Switch"]),  # Modelling.
+            hc.Platform.TEXT: None,
+            hc.Platform.TTS: None,
+            hc.Platform.UPDATE: None,
+            hc.Platform.VACUUM: (True, SAREF["Appliance"]),
+            hc.Platform.WATER_HEATER: (True, SAREF["Appliance"]),
+            hc.Platform.WEATHER: (True, SAREF["Sensor"]),
+            # Not a `platform`:
+            "device": (False, SAREF["Device"]),  # of course...
+        }
 
     def setupSAREF(self, g, namespace, importsOnly=False):
-        SAREF = Namespace("https://saref.etsi.org/core/")
-        S4BLDG = Namespace("https://saref.etsi.org/saref4bldg/")
-        HASS = Namespace("https://www.foldr.org/profiles/homeassistant/")
+        SAREF = self.terms.namespace("saref", "https://saref.etsi.org/core/")
+        S4BLDG = self.terms.namespace("s4bldg", "https://saref.etsi.org/saref4bldg/")
+        HASS = self.terms.namespace("hass", "https://www.foldr.org/profiles/homeassistant/")
         HASS_ACTION = HASS.term("action/")
         HASS_BLUEPRINT = HASS.term("blueprint/")
         g.bind("saref", SAREF)
@@ -750,7 +1166,7 @@ class HACVT:
         g.bind("hass", HASS)
         g.bind("ha_action", HASS_ACTION)
         g.bind("ha_bp", HASS_BLUEPRINT)
-        MINE = Namespace(namespace)
+        MINE = self.terms.namespace("mine", namespace)
         MINE_ACTION = MINE.term("action/")
         MINE_AUTOMATION = MINE.term("automation/")
         MINE_ENTITY = MINE.term("entity/")
@@ -763,9 +1179,8 @@ class HACVT:
         g.add((saref_import, OWL.imports, URIRef(str(SAREF))))
         g.add((saref_import, OWL.imports, URIRef(str(S4BLDG))))
 
-        # Load known types:
-        master = Graph()
-        master.parse("https://saref.etsi.org/core/v3.1.1/saref.ttl")
+        # Load known types (only once per process):
+        master = loadSAREF()
 
         if importsOnly:
             return MINE, HASS, SAREF, S4BLDG, None, master
@@ -782,9 +1197,9 @@ class HACVT:
         # TODO: light maybe_has brightness?
         g.add((HASS['Brightness'], RDFS.subClassOf, SAREF['Property']))
         # TODO: Some need alignment with SAREF! #11
-        for p in homeassistant.components.sensor.SensorDeviceClass:
+        for p in sensor.SensorDeviceClass:
             self.createPropertyIfMissing(master, HASS, SAREF, g, p.title())
-        for p in homeassistant.components.binary_sensor.BinarySensorDeviceClass:
+        for p in binary_sensor.BinarySensorDeviceClass:
             self.createPropertyIfMissing(master, HASS, SAREF, g, p.title())
 
         # Inject Service-classes
@@ -803,44 +1218,7 @@ class HACVT:
             #    print(s,d)
             #    g.add((HASS[s], MINE['provided'], HASS[d]))
 
-        # Let's patch SAREF a bit with our extensions:
-        # True/False could be replaced by having the HASS-ns on the RHS.
-        class_to_saref = {
-            hc.Platform.AIR_QUALITY: (True, SAREF["Sensor"]),
-            hc.Platform.ALARM_CONTROL_PANEL: (True, SAREF["Device"]),
-            hc.Platform.BINARY_SENSOR: (False, SAREF["Sensor"]),  # Modelling design decisions...
-            hc.Platform.BUTTON: (True, SAREF["Sensor"]),
-            hc.Platform.CALENDAR: None,
-            hc.Platform.CAMERA: (True, SAREF["Device"]),
-            hc.Platform.CLIMATE: (False, SAREF["HVAC"]),
-            hc.Platform.COVER: (True, SAREF["Actuator"]),  # ? saref4bldg:ShadingDevice
-            hc.Platform.DEVICE_TRACKER: (True, SAREF["Sensor"]),
-            hc.Platform.FAN: (True, SAREF["Appliance"]),
-            hc.Platform.GEO_LOCATION: None,
-            hc.Platform.HUMIDIFIER: (True, SAREF["Appliance"]),
-            hc.Platform.IMAGE_PROCESSING: None,
-            hc.Platform.LIGHT: (True, SAREF["Appliance"]),
-            hc.Platform.LOCK: (True, SAREF["Appliance"]),
-            # XXX Deprecated hc.Platform.MAILBOX: None,
-            hc.Platform.MEDIA_PLAYER: (True, SAREF["Appliance"]),
-            hc.Platform.NOTIFY: None,
-            hc.Platform.NUMBER: None,  # SERVICE_SET_VALUE
-            hc.Platform.REMOTE: (True, SAREF["Device"]),
-            hc.Platform.SCENE: None,
-            hc.Platform.SELECT: None,  # SERVICE_SELECT_OPTION
-            hc.Platform.SENSOR: (False, SAREF["Sensor"]),
-            hc.Platform.SIREN: (True, SAREF["Appliance"]),
-            hc.Platform.STT: None,
-            hc.Platform.SWITCH: (False, SAREF["Switch"]),  # Modelling.
-            hc.Platform.TEXT: None,
-            hc.Platform.TTS: None,
-            hc.Platform.UPDATE: None,
-            hc.Platform.VACUUM: (True, SAREF["Appliance"]),
-            hc.Platform.WATER_HEATER: (True, SAREF["Appliance"]),
-            hc.Platform.WEATHER: (True, SAREF["Sensor"]),
-            # Not a `platform`:
-            "device": (False, SAREF["Device"]),  # of course...
-        }
+        class_to_saref = HACVT.mkClassToSAREF(SAREF)
         for p, v in class_to_saref.items():
             if v is not None:
                 flag, superclass = v
@@ -882,7 +1260,7 @@ class HACVT:
         g.add((h_input_has_selector, RDF.type, OWL.ObjectProperty))
         g.add((h_input_has_selector, RDFS.domain, h_bp_input))
         g.add((h_input_has_selector, RDFS.range, h_bp_selector))
-        for s in homeassistant.helpers.selector.SELECTORS:
+        for s in selector.SELECTORS:
             g.add((HASS['blueprint/'+s.title()], RDFS.subClassOf, h_bp_selector))
 
         bp_e = HASS['blueprint/Selector_Entity']  # ENTITY_FILTER_SELECTOR_CONFIG_SCHEMA
@@ -985,15 +1363,104 @@ if __name__ == "__main__":
                         help="Set Python log level. INFO if not set, otherwise DEBUG or your value here is used.")
     parser.add_argument('-n', '--namespace', default='http://my.name.space/',
                         help="Namespace for your objects in the output. `http://my.name.space/` by default.")
-    parser.add_argument('-o', '--out', default='ha.ttl',
-                        help="Set output filename; `ha.ttl` by default.")
+    parser.add_argument('-o', '--out',
+                        help="Set output filename; `ha.ttl` by default, or `ha.nt` with `--stream`.")
+    parser.add_argument('--stream', action='store_true',
+                        help="Write N-Triples to the output while exporting instead of building the whole graph "
+                             "in memory first. The output can also be `-` for stdout or `tcp:host:port`.")
+    parser.add_argument('--dedup-window', metavar='TRIPLES', type=int, default=NTriplesWriter.WINDOW,
+                        help=f"With `--stream`, suppress duplicates among this many recent distinct triples "
+                             f"(about 150 bytes each), {NTriplesWriter.WINDOW} by default.")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="Build the graph for devices with this many parallel workers.")
+    parser.add_argument('--store', choices=['default', 'compact'], default='default',
+                        help="rdflib store for the output graph. `compact` needs much less memory for large exports, "
+                             "and writes an `--out` ending in `.nt` without going through rdflib's serializers.")
+    parser.add_argument('--echo', action='store_true',
+                        help="Also print the Turtle output to the console.")
     parser.add_argument('-p', '--privacy', nargs='*', metavar='platform*',
                         help="Enable privacy filter. `-p` gives a sensible default, otherwise use `-p person zone ...` to "
                              "specify whitelist -- any other entities NOT in the filter will have their name replaced.")
+    parser.add_argument('--no-metamodel', dest='metamodel', action='store_false',
+                        help="Don't write the metamodel `homeassistantcore.rdf`, only export the instance.")
+    parser.add_argument('--pipelined', action='store_true',
+                        help="Fetch all data concurrently over a single websocket-connection before exporting. "
+                             "Much faster on high-latency links.")
+    parser.add_argument('--previous', metavar='state.json.gz',
+                        help="State of a previous export (see `--state`): only rebuild what changed since then.")
+    parser.add_argument('--state', metavar='state.json.gz',
+                        help="Save the state of this export for a later `--previous`.")
+    parser.add_argument('--delta', metavar='delta.ru',
+                        help="Write the changes against `--previous` as SPARQL Update.")
+    parser.add_argument('--stats-json', metavar='stats.json',
+                        help="Write the statistics of the queries to Home Assistant as JSON.")
+    parser.add_argument('--no-automation-cache', dest='automation_cache', action='store_false',
+                        help="Don't keep automation configs between runs (in $HOWL_CACHE_DIR or ~/.cache/howl).")
+    parser.add_argument('--plugin', metavar='MODULE', action='append', default=[],
+                        help="Import this module before exporting, e.g. to `registerAction`/`registerTrigger` "
+                             "handlers for custom integrations. Can be given several times.")
+    parser.add_argument('--profile', metavar='DIR',
+                        help="Write a cProfile-dump per phase of the export into this directory.")
+    parser.add_argument('--slow', metavar='SECONDS', type=float, default=1.0,
+                        help="Log devices and automations that take longer than this to export, 1s by default.")
+    parser.add_argument('--dump-constants', metavar='constants.json',
+                        help="Write a snapshot of Home Assistant's constants and exit. Exports with "
+                             "HOWL_HA_CONSTANTS=constants.json in the environment start much faster.")
     # TODO: Add output filename
+    known = parser.parse_known_args()[0]
+    if known.dump_constants is not None:  # Doesn't need a URL or anything else.
+        dumpConstants(known.dump_constants, CONSTANT_MODULES)
+        exit(0)
     cli = CLISource(parser)
-    tool = HACVT(cli)
-    g = tool.main(debug=cli.args.debug, certificate=cli.args.certificate, privacy=cli.args.privacy, namespace=cli.args.namespace)
-    f_out = open(cli.args.out, "w")
-    print(g.serialize(format='turtle'), file=f_out)
+    # Plugins `import hacvt` to register their handlers, that has to be us and not a second copy:
+    sys.modules.setdefault("hacvt", sys.modules[__name__])
+    for plugin in cli.args.plugin:
+        importlib.import_module(plugin)
+    if cli.args.pipelined and cli.args.jobs > 1:
+        parser.error("--jobs can't be combined with --pipelined.")
+    if cli.args.delta is not None and cli.args.previous is None:
+        parser.error("--delta needs --previous.")
+    previous = ExportState.load(cli.args.previous) if cli.args.previous is not None else None
+    main_args = dict(debug=cli.args.debug, certificate=cli.args.certificate, privacy=cli.args.privacy,
+                     namespace=cli.args.namespace, metamodel=cli.args.metamodel, previous=previous,
+                     track=cli.args.state is not None or cli.args.delta is not None, echo=cli.args.echo,
+                     jobs=cli.args.jobs, store=cli.args.store,
+                     profiler=PhaseProfiler(cli.args.profile, cli.args.slow))
+    if cli.args.stream:
+        main_args['out'] = NTriplesWriter.open(cli.args.out or "ha.nt", window=cli.args.dedup_window)
+    if cli.args.replay is not None:
+        cs = SnapshotSource(cli.args.replay)
+    elif cli.args.pipelined:
+        cs = AsyncConfigSource.fromSource(cli)
+    else:
+        cs = cli
+    if cli.args.record is not None:
+        cs.startRecording()
+    if cli.args.automation_cache:
+        cs.useAutomationCache(cacheDir())
+    tool = HACVT(cs)
+    if isinstance(cs, AsyncConfigSource):
+        g = asyncio.run(tool.main_async(**main_args))
+    else:
+        g = tool.main(**main_args)
+    if cli.args.record is not None:
+        cs.saveSnapshot(cli.args.record)
+    if cli.args.state is not None:
+        tool.state.save(cli.args.state)
+    if cli.args.delta is not None:
+        tool.state.writeDelta(cli.args.delta, previous)
+    print(cs.stats.summary(), file=sys.stderr)
+    if cli.args.stats_json is not None:
+        with open(cli.args.stats_json, "w") as f_stats:
+            json.dump(cs.stats.toJSON(), f_stats, indent=2)
+    with tool.profiler.phase("serialize"):
+        if cli.args.stream:
+            g.close()
+        elif isinstance(g.store, CompactStore) and cli.args.out is not None and cli.args.out.endswith(".nt"):
+            with open(cli.args.out, "w", encoding="utf-8") as f_out:
+                g.store.writeNTriples(f_out)
+        else:
+            with open(cli.args.out or "ha.ttl", "w") as f_out:
+                print(g.serialize(format='turtle'), file=f_out)
+    logging.info(f"Phases: {tool.profiler.summary()}")
 
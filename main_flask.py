@@ -1,23 +1,31 @@
 # from oauthlib.oauth2 import MissingTokenError
 import argparse
-import sqlite3
+import gzip
+import json
 from sqlite3 import OperationalError
 
-from celery import shared_task, Celery, Task
+from celery import shared_task, states, Celery, Task
 from celery.result import AsyncResult
 from oauthlib.oauth2 import InsecureTransportError
 from requests_oauthlib import OAuth2Session
 from requests.exceptions import ConnectTimeout
-from flask import Flask, abort, redirect, request, session, url_for, render_template, flash, Blueprint, current_app, Response
+from flask import Flask, abort, redirect, request, session, url_for, render_template, flash, Blueprint, current_app, Response, send_file
 from flask.logging import default_handler
 # from flask_indieauth import requires_indieauth
 import logging
 from logging.config import dictConfig
 import urllib.parse
 import os
+import re
+import tempfile
+import time
 
 import hacvt
+from ArtifactStore import ArtifactStore
 from ConfigSource import ConfigSource
+from ExportDB import ExportDB
+from ExportProgress import ExportProgress
+from PhaseProfiler import PhaseProfiler
 
 
 dictConfig({
@@ -60,6 +68,10 @@ def create_app() -> Flask:
             task_ignore_result=True,
         ),
     )
+    # Workers write exports here and we serve them from here, so they have to share it:
+    myapp.config['ARTIFACTS'] = os.getenv('HOWL_ARTIFACTS', os.path.join(tempfile.gettempdir(), "howl-artifacts"))
+    myapp.extensions['exports'] = ExportDB(os.getenv('HOWL_DB', "hacvt.db"))
+    myapp.extensions['exports'].setup()
     celery_app = celery_init_app(myapp)
     myapp.register_blueprint(app)
     myapp.secret_key = os.urandom(24)
@@ -72,6 +84,14 @@ def create_app() -> Flask:
 app = Blueprint('app', __name__, template_folder='templates')
 
 
+def artifacts():
+    return ArtifactStore(current_app.config['ARTIFACTS'])
+
+
+def exports():
+    return current_app.extensions['exports']
+
+
 @app.route("/", methods=['GET', 'POST'])
 def index():
     if request.method == 'POST':
@@ -121,13 +141,23 @@ def callback():
     return redirect(url_for('app.status'))
 
 
-@shared_task(ignore_result=False)
-def traverse_ha(url, token, privacy_option):
+@shared_task(ignore_result=False, bind=True)
+def traverse_ha(self, url, token, privacy_option, profile=False):
     cs = ConfigSource(url, token)
+    # For `/task/<rid>/events`, throttled so that we don't flood the result backend:
+    progress = ExportProgress(lambda state: self.update_state(state='PROGRESS', meta=state), interval=1.0)
     tool = hacvt.HACVT(cs)
-    g = tool.main(cs, privacy=privacy_option)
-    ha_data = g.serialize(format='turtle')
-    return ha_data
+    # pstats-files stay on the worker, we only report where they are:
+    profile_dir = tempfile.mkdtemp(prefix="howl-profile-") if profile else None
+    profiler = PhaseProfiler(profile_dir)
+    # Nobody picks up the metamodel from the worker's directory, so don't bother:
+    g = tool.main(privacy=privacy_option, metamodel=False, profiler=profiler, progress=progress)
+    progress.phase("serialize")
+    # Multi-MB exports don't belong in the result backend, they go to disk and we only pass on the handle:
+    with profiler.phase("serialize"), artifacts().writer() as (out, handle):
+        g.serialize(destination=out, format='turtle')
+    # The query statistics help to spot installations where one kind of query dominates:
+    return {'artifact': handle, 'stats': cs.stats.toJSON(), 'phases': profiler.phases, 'profile': profile_dir}
 
 
 @app.route("/status", methods=["GET"])
@@ -137,9 +167,11 @@ def status():
     privacy_option = session['privacy']
     # We yolo and hope that we finish before expiry.
     api_url = urllib.parse.urljoin(session['url'], '/api/')
-    result = traverse_ha.delay(api_url, t['access_token'], privacy_option)
-    # TODO: Use some kind of progress indicator and send this in the background.
-    # used in template
+    # Exports nobody submitted, unless HOWL_ARTIFACT_HOURS says otherwise:
+    artifacts().prune(3600 * float(os.getenv('HOWL_ARTIFACT_HOURS', 24)))
+    # Set HOWL_PROFILE on the web server to profile all exports on the workers:
+    result = traverse_ha.delay(api_url, t['access_token'], privacy_option, profile=bool(os.getenv('HOWL_PROFILE')))
+    # The page follows the progress through `/task/<rid>/events`.
 
     # Show data to user if they want us to keep it.
     return render_template('processing.html', rid=result.id)
@@ -149,29 +181,104 @@ def status():
 def task(rid):
     result = AsyncResult(rid)
     if result.ready():
+        if not result.successful():
+            # FAILURE or REVOKED, then the result is the exception:
+            current_app.logger.warning(f"Task {rid} {result.state}: {result.result!r}")
+            result.forget()
+            return ("<html><body><p>Sorry, your export failed :-( Please try again from the "
+                    f"<a href=\"{url_for('app.index')}\">start page</a>.</p></body></html>", 500)
         data = result.result
         result.forget()
-        return render_template('submit.html', ha_data=data)
+        current_app.logger.info(f"Task {rid}: {data['stats']}, phases {data['phases']}, profile {data['profile']}")
+        session['artifact'] = data['artifact']['sha256']
+        return render_template('submit.html', artifact=data['artifact'])
     else:
-        return "<html><body><p>not ready :-( Just hit reload... Or are you looking at an old task from long ago that has already expired?</p></body></html>"
+        return "<html><body><p>Not ready :-( Are you looking at an old task from long ago that has already expired?</p></body></html>"
+
+
+# How often we look at the result backend for each client that follows a task, and for how long at most.
+#  Tasks only update their progress once a second anyway.
+EVENTS_POLL = 2.0
+EVENTS_TIMEOUT = 600
+
+
+@app.route('/task/<rid>/events')
+def task_events(rid):
+    # Server-sent events with the progress of the export, and where to get the result when it's done.
+    done_url = url_for('app.task', rid=rid)
+    backend = current_app.extensions["celery"].backend
+
+    def events():
+        last = None
+        sent = time.monotonic()
+        deadline = sent + EVENTS_TIMEOUT
+        while time.monotonic() < deadline:
+            # One round trip per poll: `AsyncResult.ready()`, `.state` and `.info` each ask the backend again.
+            meta = backend.get_task_meta(rid)
+            if meta['status'] in states.READY_STATES:
+                failed = meta['status'] != states.SUCCESS
+                yield f"event: done\ndata: {json.dumps({'url': done_url, 'failed': failed})}\n\n"
+                return
+            if meta['status'] == 'PROGRESS' and meta['result'] != last:
+                last = meta['result']
+                sent = time.monotonic()
+                yield f"event: progress\ndata: {json.dumps(last)}\n\n"
+            elif time.monotonic() - sent > 15:
+                sent = time.monotonic()
+                yield ": waiting\n\n"  # A comment, keeps proxies from closing the connection.
+            time.sleep(EVENTS_POLL)
+        yield "event: timeout\ndata: {}\n\n"
+    return Response(events(), mimetype="text/event-stream", headers={'Cache-Control': "no-cache",
+                                                                       'X-Accel-Buffering': "no"})
+
+@app.route('/artifact/<sha256>')
+def artifact(sha256):
+    store = artifacts()
+    if not re.fullmatch(r"[0-9a-f]{64}", sha256) or not store.exists(sha256):
+        abort(404)
+    if 'gzip' in request.accept_encodings:
+        # The file as it is, with its size as Content-Length:
+        response = send_file(store.path(sha256), mimetype="text/turtle", as_attachment=True, download_name="ha.ttl",
+                             etag=sha256)
+        response.headers['Content-Encoding'] = "gzip"
+        return response
+
+    def chunks():
+        with gzip.open(store.path(sha256), "rb") as f:
+            while chunk := f.read(1 << 16):
+                yield chunk
+    return Response(chunks(), mimetype="text/turtle", headers={'Content-Disposition': "attachment; filename=ha.ttl"})
+
 
 @app.route("/submit", methods=["POST"])
 def submit():
-    conn = sqlite3.connect("hacvt.db")
-    conn.row_factory = sqlite3.Row
-    conn.execute("CREATE TABLE IF NOT EXISTS data (datetime, url TEXT NOT NULL, privacy, data TEXT)")
-    conn.execute("INSERT INTO data VALUES(datetime('now'),?,?,?)", (session['url'], session['privacy'], request.form['data']))
-    conn.commit()
-    conn.close()
+    if 'artifact' not in session:
+        abort(400, description="Nothing to submit, or you already did.")
+    if not artifacts().exists(session['artifact']):
+        abort(410, description="Your data has expired, please export it again.")
+    # Both are gzipped, so the artifact goes in as it is, chunk by chunk:
+    with artifacts().open(session['artifact']) as f:
+        exports().add(session['url'], session['privacy'], f, os.fstat(f.fileno()).st_size)
+    session.pop('artifact')
     return "Thank you!"
 
 
 @app.route("/query/<int:id>")
 def query(id):
-    conn = sqlite3.connect("hacvt.db")
-    conn.row_factory = sqlite3.Row
-    res = conn.execute("SELECT data FROM data")
-    return Response(response=res.fetchall()[id], mimetype="text/turtle")
+    blob = exports().open(id)
+    if blob is None:
+        abort(404)
+    gzipped = 'gzip' in request.accept_encodings
+
+    def chunks():
+        with blob:
+            f = blob if gzipped else gzip.GzipFile(fileobj=blob)
+            while chunk := f.read(1 << 16):
+                yield chunk
+    if gzipped:
+        return Response(chunks(), mimetype="text/turtle",
+                        headers={'Content-Encoding': "gzip", 'Content-Length': str(len(blob))})
+    return Response(chunks(), mimetype="text/turtle")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()